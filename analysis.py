@@ -7,13 +7,43 @@ import os
 import io
 import re
 import json
+import time
+import hashlib
+import random
+import shutil
 import logging
-from typing import Dict, Any, Tuple, Set
-
-from tenacity import retry, stop_after_attempt, wait_exponential
+import threading
+import subprocess
+from typing import Dict, Any, Tuple, List, Optional, Iterator
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+import requests
+# Optional faster engine for the JSON cleanup patterns; stdlib re otherwise
+try:
+    import regex as _re_engine
+except ImportError:
+    _re_engine = re
+
+from tenacity import (
+    retry,
+    stop_after_attempt,
+    wait_exponential,
+    wait_random_exponential,
+    retry_if_exception_type,
+)
 from googleapiclient.http import MediaIoBaseDownload
+from google.api_core.exceptions import (
+    DeadlineExceeded,
+    InternalServerError,
+    ResourceExhausted,
+    ServiceUnavailable,
+)
 import google.generativeai as genai
 
+import sheets
+import config_index
+
 # -------------------------------------------------------------------
 # ENV & LOGGING
 # -------------------------------------------------------------------
@@ -26,11 +56,16 @@ logging.basicConfig(
 genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
 
 DEFAULT_MODEL = "gemini-2.5-flash"
+DEFAULT_OPENROUTER_MODEL = "deepseek/deepseek-chat-v3-0324:free"
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
 ALLOWED_MIME_PREFIXES = ("audio/", "video/")
 
 MAX_FILE_MB = 150
 MAX_TRANSCRIPT_CHARS = 120_000
 
+BATCH_SIZE = 64          # prepared transcripts analyzed per batch
+BATCH_CONCURRENCY = 4    # in-flight Gemini requests per batch (free-tier RPM)
+
 # -------------------------------------------------------------------
 # FULL ERP FEATURE MAP
 # -------------------------------------------------------------------
@@ -103,33 +138,182 @@ def _download_drive_file(drive_service, file_id: str, out_path: str) -> str:
     return mime_type
 
 
+# 16 kHz mono Opus is what the speech models need; drops video streams and
+# cuts inline upload size by an order of magnitude.
+_SILENCE_FILTER = "silenceremove=stop_periods=-1:stop_duration=2:stop_threshold=-45dB"
+
+
+def _preprocess_audio(in_path: str, out_path: str, trim_silence: bool = True) -> Optional[str]:
+    """
+    Decode once with ffmpeg to 16 kHz mono Opus, optionally cutting pauses
+    longer than 2s. Returns the new path, or None to keep the original.
+    """
+    if not shutil.which("ffmpeg"):
+        return None
+
+    cmd = ["ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-i", in_path, "-vn", "-ac", "1", "-ar", "16000"]
+    if trim_silence:
+        cmd += ["-af", _SILENCE_FILTER]
+    cmd += ["-c:a", "libopus", "-b:a", "24k", out_path]
+
+    try:
+        subprocess.run(cmd, check=True, capture_output=True, timeout=600)
+    except Exception as e:
+        logging.warning(f"Audio preprocessing skipped: {e}")
+        return None
+
+    return out_path if os.path.getsize(out_path) > 0 else None
+
+
+_NON_WORD = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+_UNSAFE_FILENAME = re.compile(r"[^\w\.-]")
+_JSON_FENCE = _re_engine.compile(r"^```(?:json)?\s*|\s*```$", _re_engine.I)
+_TRAILING_COMMA = _re_engine.compile(r",\s*([\]}])")
+_JSON_DECODER = json.JSONDecoder()
+
+
+class _JsonObjectScanner:
+    """
+    Incremental brace matcher over streamed text. feed() returns True once
+    the first top-level {...} object is closed; `end` is then its length
+    in characters across everything fed so far. Braces inside JSON
+    strings are ignored.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.seen = 0
+        self.end = -1
+
+    def feed(self, chunk: str) -> bool:
+        depth, in_string, escaped = self.depth, self.in_string, self.escaped
+
+        for i, ch in enumerate(chunk):
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = depth > 0
+            elif ch == "{":
+                depth += 1
+            elif ch == "}" and depth:
+                depth -= 1
+                if depth == 0:
+                    self.end = self.seen + i + 1
+                    return True
+
+        self.depth, self.in_string, self.escaped = depth, in_string, escaped
+        self.seen += len(chunk)
+        return False
+
+
 def _normalize(text: str) -> str:
-    text = re.sub(r"[^\w\s]", "", text.lower())
-    return re.sub(r"\s+", " ", text).strip()
+    text = _NON_WORD.sub("", text.lower())
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+# Keyword lists normalized once at import, not per transcript
+_FEATURE_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    feature: tuple(_normalize(k) for k in keywords)
+    for feature, keywords in {**ERP_FEATURES, **ASP_FEATURES}.items()
+}
 
 
 def _feature_coverage(transcript: str) -> Tuple[str, str]:
     norm = _normalize(transcript)
     covered, missed = set(), set()
 
-    combined = {**ERP_FEATURES, **ASP_FEATURES}
-    for feature, keywords in combined.items():
-        if any(_normalize(k) in norm for k in keywords):
+    for feature, keywords in _FEATURE_KEYWORDS.items():
+        if any(k in norm for k in keywords):
             covered.add(feature)
         else:
             missed.add(feature)
 
-    coverage = f"{len(covered)}/{len(combined)} covered: {', '.join(sorted(covered))}"
+    coverage = f"{len(covered)}/{len(_FEATURE_KEYWORDS)} covered: {', '.join(sorted(covered))}"
     missed_text = "- " + "\n- ".join(sorted(missed)) if missed else "NA"
     return coverage, missed_text
 
 
+# -------------------------------------------------------------------
+# HEADER COERCION
+# -------------------------------------------------------------------
+EXACT_HEADERS = sheets.DEFAULT_HEADERS
+
+# Common LLM spellings that don't normalize onto a header on their own
+ALIAS_MAP = {
+    "Owner": "Owner (Who handled the meeting)",
+    "Percent Score": "% Score",
+    "Percentage Score": "% Score",
+    "Score %": "% Score",
+    "Email": "Email Id",
+    "Meeting Duration": "Meeting duration (min)",
+    "Cross-Sell": "Cross-Sell / Opportunity Handling",
+    "Risks": "Risks / Unresolved Issues",
+}
+
+
+def _header_key(name: str) -> str:
+    return name.lower().replace(" ", "").replace("_", "")
+
+
+_EXACT_HEADER_SET = frozenset(EXACT_HEADERS)
+_NORM_HEADER = {_header_key(h): h for h in EXACT_HEADERS}
+_ALIAS_MAP_LOWER = {k.lower(): v for k, v in ALIAS_MAP.items()}
+
+
+def _coerce_to_exact_headers(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Re-key an LLM reply onto the exact sheet headers. Exact keys win over
+    near-misses; unrecognised keys are kept as-is.
+    """
+    out = {k: v for k, v in data.items() if k in _EXACT_HEADER_SET}
+
+    for key, value in data.items():
+        if key in _EXACT_HEADER_SET:
+            continue
+        name = str(key).strip()
+        hit = _NORM_HEADER.get(_header_key(name)) or _ALIAS_MAP_LOWER.get(name.lower())
+        out.setdefault(hit or key, value)
+
+    return out
+
+
+# -------------------------------------------------------------------
+# GEMINI — MODEL CACHE
+# -------------------------------------------------------------------
+_MODEL_CACHE: Dict[str, "genai.GenerativeModel"] = {}
+_MODEL_LOCK = threading.Lock()
+
+
+def _get_model(model_name: str) -> "genai.GenerativeModel":
+    """
+    Return a shared GenerativeModel per model name (thread-safe).
+    """
+    model = _MODEL_CACHE.get(model_name)
+    if model is None:
+        with _MODEL_LOCK:
+            model = _MODEL_CACHE.get(model_name)
+            if model is None:
+                model = genai.GenerativeModel(model_name)
+                _MODEL_CACHE[model_name] = model
+    return model
+
+
 # -------------------------------------------------------------------
 # GEMINI — TRANSCRIPTION
 # -------------------------------------------------------------------
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(min=2, max=20))
-def gemini_transcribe(file_path: str, mime_type: str, model_name: str) -> str:
-    model = genai.GenerativeModel(model_name)
+def stream_transcript(file_path: str, mime_type: str, model_name: str) -> Iterator[str]:
+    """
+    Yield transcript text chunks as Gemini produces them.
+    """
+    model = _get_model(model_name)
 
     with open(file_path, "rb") as f:
         media_bytes = f.read()
@@ -140,46 +324,460 @@ def gemini_transcribe(file_path: str, mime_type: str, model_name: str) -> str:
             "mime_type": mime_type,
             "data": media_bytes
         }
-    ])
+    ], stream=True)
+
+    # Drop our reference to the upload buffer while the reply streams in
+    del media_bytes
+
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            continue  # e.g. the final chunk carries only finish_reason
+        if text:
+            yield text
+
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(min=2, max=20))
+def gemini_transcribe(file_path: str, mime_type: str, model_name: str) -> str:
+    buf = io.StringIO()
+    for text in stream_transcript(file_path, mime_type, model_name):
+        buf.write(text)
 
-    return response.text or ""
+    return buf.getvalue()
 
 
 # -------------------------------------------------------------------
 # GEMINI — ANALYSIS
 # -------------------------------------------------------------------
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(min=2, max=20))
-def gemini_analyze(transcript: str, master_prompt: str, model_name: str) -> Dict[str, Any]:
-    model = genai.GenerativeModel(model_name)
+PROMPT_PATH = "prompt.txt"
+
+_PROMPT_CACHE: Tuple[float, str] = (-1.0, "")
+_PROMPT_LOCK = threading.Lock()
+
+
+def _prompt_template() -> str:
+    """prompt.txt contents, re-read only when the file's mtime changes."""
+    global _PROMPT_CACHE
+    mtime = os.stat(PROMPT_PATH).st_mtime
+
+    cached_mtime, template = _PROMPT_CACHE
+    if mtime == cached_mtime:
+        return template
+
+    with _PROMPT_LOCK:
+        if _PROMPT_CACHE[0] != mtime:
+            with open(PROMPT_PATH, encoding="utf-8") as f:
+                _PROMPT_CACHE = (mtime, f.read().strip())
+        return _PROMPT_CACHE[1]
+
+
+def _build_prompt(transcript: str, master_prompt: str, owner_name: str = "N/A") -> str:
+    """
+    Fill the {owner_name} / {transcript} placeholders. str.replace rather
+    than str.format: the template's JSON example is full of braces.
+    Templates without {transcript} get it appended.
+    """
+    prompt = master_prompt.replace("{owner_name}", owner_name)
 
-    prompt = f"""
-{master_prompt}
+    if "{transcript}" in prompt:
+        return prompt.replace("{transcript}", transcript)
+
+    return f"""
+{prompt}
 
 ---
 MEETING TRANSCRIPT:
 {transcript}
 """
 
-    response = model.generate_content(
+
+# Server-enforced output shape for Gemini: every sheet column, as a string.
+# Guarantees clean JSON with exactly these keys, so nothing has to be
+# repaired or remapped on this path.
+ANALYSIS_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {h: {"type": "STRING"} for h in EXACT_HEADERS},
+    "required": list(EXACT_HEADERS),
+}
+
+_ANALYSIS_GENERATION_CONFIG = {
+    "temperature": 0.2,
+    "response_mime_type": "application/json",
+    "response_schema": ANALYSIS_RESPONSE_SCHEMA,
+}
+
+
+# -------------------------------------------------------------------
+# GEMINI — QUOTA GUARD
+# -------------------------------------------------------------------
+GEMINI_COOLDOWN_SEC = 60
+
+# monotonic deadline; while in the future, analysis skips Gemini when the
+# OpenRouter fallback is enabled
+_GEMINI_COOLDOWN_UNTIL = 0.0
+_GEMINI_BUCKET: Optional["_TokenBucket"] = None
+_GEMINI_GUARD_LOCK = threading.Lock()
+
+
+class _TokenBucket:
+    """Thread-safe token bucket: `rate_per_min` calls, bursts up to `burst`."""
+
+    def __init__(self, rate_per_min: float, burst: int = 1):
+        self.rate = rate_per_min / 60.0
+        self.capacity = float(max(1, burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay + random.uniform(0, 0.25))
+
+
+def _configure_gemini_guard(config):
+    """Build the request limiter once from `google_llm.requests_per_minute` (0 = off)."""
+    global _GEMINI_BUCKET
+    if _GEMINI_BUCKET is not None:
+        return
+
+    rpm = float(config.get("google_llm", {}).get("requests_per_minute", 0) or 0)
+    if rpm <= 0:
+        return
+
+    with _GEMINI_GUARD_LOCK:
+        if _GEMINI_BUCKET is None:
+            _GEMINI_BUCKET = _TokenBucket(rpm)
+
+
+def gemini_in_cooldown() -> bool:
+    return time.monotonic() < _GEMINI_COOLDOWN_UNTIL
+
+
+def _trip_gemini_cooldown():
+    global _GEMINI_COOLDOWN_UNTIL
+    with _GEMINI_GUARD_LOCK:
+        _GEMINI_COOLDOWN_UNTIL = time.monotonic() + GEMINI_COOLDOWN_SEC
+    logging.warning(f"Gemini quota exhausted; routing analysis to the fallback (if enabled) for {GEMINI_COOLDOWN_SEC}s")
+
+
+# Quota errors back off here (then trip the cooldown in _call_gemini);
+# other transient failures are retried around the parse in _gemini_analysis.
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_random_exponential(min=1, max=30),
+    retry=retry_if_exception_type(ResourceExhausted),
+    reraise=True,
+)
+def _generate_with_backoff(prompt: str, model_name: str) -> str:
+    if _GEMINI_BUCKET is not None:
+        _GEMINI_BUCKET.acquire()
+
+    response = _get_model(model_name).generate_content(
         prompt,
-        generation_config={"temperature": 0.2}
+        generation_config=_ANALYSIS_GENERATION_CONFIG,
+        stream=True,
     )
 
-    raw = (response.text or "").strip()
-    raw = raw.replace("```json", "").replace("```", "").strip()
+    # Stop reading as soon as the first JSON object is complete; anything
+    # the model says after it is discarded by the parser anyway.
+    buf = io.StringIO()
+    scanner = _JsonObjectScanner()
+
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            continue
+        if not text:
+            continue
+        buf.write(text)
+        if scanner.feed(text):
+            return buf.getvalue()[:scanner.end]
+
+    return buf.getvalue()
+
+
+def _call_gemini(prompt: str, model_name: str) -> str:
+    try:
+        return _generate_with_backoff(prompt, model_name)
+    except ResourceExhausted:
+        _trip_gemini_cooldown()
+        raise
+
+
+def _safe_json_from_text(text: str) -> Dict[str, Any]:
+    """
+    Parse the first JSON object out of an LLM response.
+    Tolerates markdown fences and leading/trailing chatter.
+    """
+    raw = _JSON_FENCE.sub("", (text or "").strip())
 
     try:
         return json.loads(raw)
     except json.JSONDecodeError:
-        raise ValueError("Gemini returned invalid JSON")
+        pass
+
+    # raw_decode stops at the end of the first complete object, so any
+    # trailing chatter after it is ignored without slicing.
+    for attempt in (raw, _TRAILING_COMMA.sub(r"\1", raw)):
+        start = attempt.find("{")
+        if start == -1:
+            break
+        try:
+            obj, _ = _JSON_DECODER.raw_decode(attempt, start)
+            return obj
+        except json.JSONDecodeError:
+            pass
+
+    raise ValueError("LLM returned invalid JSON")
+
+
+# -------------------------------------------------------------------
+# OPENROUTER — FALLBACK PROVIDER
+# -------------------------------------------------------------------
+# One pooled session for all calls: keep-alive skips a TCP + TLS
+# handshake per request. requests.Session is safe for concurrent posts.
+_OPENROUTER_SESSION = requests.Session()
+
+
+@retry(stop=stop_after_attempt(2), wait=wait_exponential(min=2, max=10))
+def _call_openrouter(prompt: str, model_name: str) -> str:
+    api_key = os.environ.get("OPENROUTER_API_KEY")
+    if not api_key:
+        raise ValueError("OPENROUTER_API_KEY not set")
+
+    response = _OPENROUTER_SESSION.post(
+        OPENROUTER_URL,
+        headers={"Authorization": f"Bearer {api_key}"},
+        json={
+            "model": model_name,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": 0.2,
+        },
+        timeout=180,
+    )
+    response.raise_for_status()
+
+    return response.json()["choices"][0]["message"]["content"] or ""
+
+
+def _parse_provider_reply(text: str) -> Dict[str, Any]:
+    data = _safe_json_from_text(text)
+    if not isinstance(data, dict) or not data:
+        raise ValueError("LLM returned an empty JSON object")
+    return data
+
+
+# Transient Gemini failures and truncated / unparseable replies (ValueError)
+# get a few more tries; quota errors are handled inside _call_gemini.
+_GEMINI_RETRYABLE = (ServiceUnavailable, DeadlineExceeded, InternalServerError, ValueError)
+
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(min=2, max=20),
+    retry=retry_if_exception_type(_GEMINI_RETRYABLE),
+    reraise=True,
+)
+def _gemini_analysis(prompt: str, model_name: str) -> Dict[str, Any]:
+    return _parse_provider_reply(_call_gemini(prompt, model_name))
+
+
+def _openrouter_analysis(prompt: str, model_name: str) -> Dict[str, Any]:
+    return _parse_provider_reply(_call_openrouter(prompt, model_name))
+
+
+def _race_providers(prompt: str, providers: List[Tuple[str, Any, str]]) -> Dict[str, Any]:
+    """
+    Fire every provider at once and return the first reply that parses to a
+    non-empty JSON object. Losers are cancelled best-effort.
+    """
+    pool = ThreadPoolExecutor(max_workers=len(providers))
+    futures = {pool.submit(call, prompt, model): name for name, call, model in providers}
+    last_err: Optional[Exception] = None
+
+    try:
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                name = futures[fut]
+                try:
+                    data = fut.result()
+                    logging.info(f"Analysis answered by {name}")
+                    return data
+                except Exception as e:
+                    last_err = e
+                    logging.warning(f"{name} analysis failed: {e}")
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    raise last_err or ValueError("No LLM provider available")
+
+
+def analyze_transcript(prompt: str, config) -> Dict[str, Any]:
+    """
+    Run the analysis prompt on Gemini. Only with `analysis.openrouter_fallback`
+    (default off) and OPENROUTER_API_KEY set is OpenRouter tried after a
+    Gemini failure; the transcript then leaves Google and the row is scored
+    by a different model. `analysis.race_providers` queries both concurrently
+    instead (2x LLM calls).
+    """
+    model_name = config.get("google_llm", {}).get("model", DEFAULT_MODEL)
+    analysis_cfg = config.get("analysis", {}) or {}
+
+    _configure_gemini_guard(config)
+
+    providers = [("Gemini", _gemini_analysis, model_name)]
+    if analysis_cfg.get("openrouter_fallback", False) and os.environ.get("OPENROUTER_API_KEY"):
+        providers.append((
+            "OpenRouter",
+            _openrouter_analysis,
+            analysis_cfg.get("openrouter_model", DEFAULT_OPENROUTER_MODEL),
+        ))
+
+        # Quota storm: don't queue more calls that will just 429
+        if gemini_in_cooldown():
+            providers = providers[1:]
+
+    if len(providers) > 1 and analysis_cfg.get("race_providers", False):
+        return _race_providers(prompt, providers)
+
+    last_err: Optional[Exception] = None
+    for name, call, model in providers:
+        try:
+            return call(prompt, model)
+        except Exception as e:
+            last_err = e
+            logging.warning(f"{name} analysis failed: {e}")
+
+    raise last_err
 
 
 # -------------------------------------------------------------------
-# MAIN ENTRY — SINGLE FILE
+# PIPELINE CACHE — keyed by Drive md5Checksum
 # -------------------------------------------------------------------
-def process_single_file(drive_service, gsheets_sheet, file_meta, member_name, config):
+# {md5}.json holds {"transcript", "prompt_sha", "analysis"} so a rerun of
+# unchanged content skips download, transcription and (if the prompt is
+# unchanged) the LLM call. Entries are dropped once the file is processed,
+# so only failed / quarantined files keep their transcript on disk.
+def _cache_path(md5: Optional[str], config) -> Optional[str]:
+    cache_cfg = config.get("cache", {}) or {}
+    if not md5 or not cache_cfg.get("enabled", True):
+        return None
+    return os.path.join(cache_cfg.get("dir", "cache"), f"{md5}.json")
+
+
+def load_cached(md5: Optional[str], config) -> Dict[str, Any]:
+    path = _cache_path(md5, config)
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable cache entry {path}: {e}")
+        return {}
+
+
+def store_cached(md5: Optional[str], config, **fields):
+    """Merge `fields` into the cache entry; atomic so workers never see partial files."""
+    path = _cache_path(md5, config)
+    if not path:
+        return
+    try:
+        entry = load_cached(md5, config)
+        entry.update(fields)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logging.warning(f"Could not write cache entry {path}: {e}")
+
+
+def drop_cached(md5: Optional[str], config):
+    path = _cache_path(md5, config)
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.warning(f"Could not remove cache entry {path}: {e}")
+
+
+def prune_cache(config):
+    """Remove entries older than `cache.max_age_days` (files left in quarantine or deleted from Drive)."""
+    cache_cfg = config.get("cache", {}) or {}
+    max_age_days = float(cache_cfg.get("max_age_days", 30) or 0)
+    cache_dir = cache_cfg.get("dir", "cache")
+    if max_age_days <= 0 or not os.path.isdir(cache_dir):
+        return
+
+    cutoff = time.time() - max_age_days * 86400
+    removed = 0
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            if name.endswith(".json") and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError as e:
+            logging.warning(f"Could not prune cache entry {path}: {e}")
+    if removed:
+        logging.info(f"Pruned {removed} stale cache entr{'y' if removed == 1 else 'ies'}")
+
+
+def _prompt_sha(prompt: str) -> str:
+    return hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+
+
+# -------------------------------------------------------------------
+# STAGE 1 — DOWNLOAD + TRANSCRIBE + BUILD PROMPT
+# -------------------------------------------------------------------
+def _make_job(file_meta, member_name, transcript: str, cached: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    prompt = _build_prompt(transcript, _prompt_template(), member_name)
+    job = {
+        "file_id": file_meta["id"],
+        "file_name": file_meta.get("name", file_meta["id"]),
+        "member_name": member_name,
+        "md5": file_meta.get("md5Checksum"),
+        "transcript": transcript,
+        "prompt": prompt,
+    }
+
+    # A cached analysis is only valid for the prompt that produced it
+    if cached and cached.get("analysis") and cached.get("prompt_sha") == _prompt_sha(prompt):
+        job["cached_analysis"] = cached["analysis"]
+
+    return job
+
+
+def prepare_file(drive_service, file_meta, member_name, config) -> Dict[str, Any]:
+    """
+    Download and transcribe one Drive file and build its analysis prompt.
+    Returns a pending job for run_batch(); raises on failure.
+    """
     file_id = file_meta["id"]
     file_name = file_meta.get("name", file_id)
+    md5 = file_meta.get("md5Checksum")
+
+    cached = load_cached(md5, config)
+    if cached.get("transcript"):
+        logging.info(f"Cache hit (transcript): {file_name}")
+        return _make_job(file_meta, member_name, cached["transcript"], cached)
 
     file_size = int(file_meta.get("size", 0))
     if file_size > MAX_FILE_MB * 1024 * 1024:
@@ -188,8 +786,9 @@ def process_single_file(drive_service, gsheets_sheet, file_meta, member_name, co
     tmp_dir = config.get("runtime", {}).get("tmp_dir", "/tmp")
     os.makedirs(tmp_dir, exist_ok=True)
 
-    safe_name = re.sub(r"[^\w\.-]", "_", file_name)
+    safe_name = _UNSAFE_FILENAME.sub("_", file_name)
     local_path = os.path.join(tmp_dir, f"{file_id}_{safe_name}")
+    audio_path = f"{local_path}.16k.ogg"
 
     try:
         logging.info(f"Processing: {file_name}")
@@ -198,44 +797,153 @@ def process_single_file(drive_service, gsheets_sheet, file_meta, member_name, co
         if not _is_media_supported(mime_type):
             raise ValueError("Unsupported media type")
 
-        model_name = config.get("google_llm", {}).get("model", DEFAULT_MODEL)
+        llm_cfg = config.get("google_llm", {})
+        transcribe_model = llm_cfg.get("transcribe_model") or llm_cfg.get("model", DEFAULT_MODEL)
 
-        transcript = gemini_transcribe(local_path, mime_type, model_name)
+        media_path, media_mime = local_path, mime_type
+        runtime_cfg = config.get("runtime", {})
+        if runtime_cfg.get("preprocess_audio", True):
+            trim = runtime_cfg.get("trim_silence", True)
+            if _preprocess_audio(local_path, audio_path, trim_silence=trim):
+                media_path, media_mime = audio_path, "audio/ogg"
+
+        transcript = gemini_transcribe(media_path, media_mime, transcribe_model)
         if not transcript.strip():
             raise ValueError("Empty transcript")
 
         if len(transcript) > MAX_TRANSCRIPT_CHARS:
             transcript = transcript[:MAX_TRANSCRIPT_CHARS]
 
-        with open("prompt.txt", encoding="utf-8") as f:
-            master_prompt = f.read().strip()
+        store_cached(md5, config, transcript=transcript)
+        return _make_job(file_meta, member_name, transcript)
+
+    finally:
+        for path in (local_path, audio_path):
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except Exception:
+                    pass
+
+
+# -------------------------------------------------------------------
+# SCORES
+# -------------------------------------------------------------------
+# The five 2–10 components from prompt.txt; Total = sum (0–50)
+SCORE_KEYS = [
+    "Opening Pitch Score",
+    "Product Pitch Score",
+    "Cross-Sell / Opportunity Handling",
+    "Closing Effectiveness",
+    "Negotiation Strength",
+]
+MAX_TOTAL_SCORE = 10 * len(SCORE_KEYS)
+
+_NUMERIC_SCORE = re.compile(r"-?\d+(?:\.\d+)?%?")
+
+
+def _to_score(value: Any) -> float:
+    """Numeric score or NaN; one regex check instead of try/except per value."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    s = str(value).strip() if value is not None else ""
+    if _NUMERIC_SCORE.fullmatch(s):
+        return float(s.rstrip("%"))
+    return float("nan")
+
+
+def _apply_score_totals(results: List[Dict[str, Any]]):
+    """
+    Recompute "Total Score" / "% Score" for a batch of analyses in one
+    vectorized pass. Rows with a missing component keep the LLM's values.
+    """
+    if not results:
+        return
+
+    scores = np.array([[_to_score(r.get(k)) for k in SCORE_KEYS] for r in results], dtype=float)
+    complete = ~np.isnan(scores).any(axis=1)
+    totals = np.clip(scores, 0, 10).sum(axis=1)
+    pcts = np.round(totals / MAX_TOTAL_SCORE * 100, 1)
+
+    for r, ok, total, pct in zip(results, complete.tolist(), totals.tolist(), pcts.tolist()):
+        if ok:
+            r["Total Score"] = int(total) if total.is_integer() else round(total, 1)
+            r["% Score"] = pct
+
 
-        analysis = gemini_analyze(transcript, master_prompt, model_name)
+# -------------------------------------------------------------------
+# STAGE 2 — BATCHED ANALYSIS + SHEET WRITE
+# -------------------------------------------------------------------
+def _analyze_job(job: Dict[str, Any], config) -> Dict[str, Any]:
+    raw = job.get("cached_analysis")
+    if raw is None:
+        raw = analyze_transcript(job["prompt"], config)
+        store_cached(job.get("md5"), config, analysis=raw, prompt_sha=_prompt_sha(job["prompt"]))
+    else:
+        logging.info(f"Cache hit (analysis): {job['file_name']}")
+
+    analysis = _coerce_to_exact_headers(raw)
+
+    transcript = job["transcript"]
+    coverage, missed = _feature_coverage(transcript)
+
+    analysis.update({
+        "Feature Checklist Coverage": coverage,
+        "Missed Opportunities": missed,
+        "transcript_full": transcript,
+        "Owner (Who handled the meeting)": job["member_name"],
+        "Society Name": os.path.splitext(job["file_name"])[0],
+    })
+
+    # Fill Manager / Team / emails from config where the LLM had nothing
+    defaults = config_index.MANAGER_INFO.get(job["member_name"], {})
+    analysis.update({k: v for k, v in defaults.items() if analysis.get(k) in (None, "", "N/A")})
+
+    return analysis
+
+
+def run_batch(writer, jobs: List[Dict[str, Any]], config) -> Dict[str, Optional[Exception]]:
+    """
+    Analyze prepared jobs in batches of up to `google_llm.batch_size`,
+    issuing the LLM requests of a batch concurrently, then queue each
+    result on the sheets.SheetsWriter. Returns {file_id: None on success,
+    exception on failure}.
+    """
+    llm_cfg = config.get("google_llm", {})
+    batch_size = max(1, int(llm_cfg.get("batch_size", BATCH_SIZE)))
+    concurrency = max(1, int(llm_cfg.get("batch_concurrency", BATCH_CONCURRENCY)))
+
+    outcome: Dict[str, Optional[Exception]] = {}
+
+    for i in range(0, len(jobs), batch_size):
+        batch = jobs[i:i + batch_size]
+
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(batch))) as pool:
+            futures = {job["file_id"]: pool.submit(_analyze_job, job, config) for job in batch}
+
+        results: Dict[str, Any] = {}
+        for job in batch:
+            try:
+                results[job["file_id"]] = futures[job["file_id"]].result()
+            except Exception as e:
+                results[job["file_id"]] = e
 
-        coverage, missed = _feature_coverage(transcript)
+        _apply_score_totals([r for r in results.values() if isinstance(r, dict)])
 
-        analysis.update({
-            "Feature Checklist Coverage": coverage,
-            "Missed Opportunities": missed,
-            "transcript_full": transcript,
-            "Owner (Who handled the meeting)": member_name,
-            "Society Name": os.path.splitext(file_name)[0],
-        })
+        for job in batch:
+            file_id, file_name = job["file_id"], job["file_name"]
+            result = results[file_id]
 
-        import sheets
-        sheets.write_analysis_result(gsheets_sheet, analysis, config)
-        sheets.update_ledger(gsheets_sheet, file_id, "Processed", "Success", config, file_name)
+            if isinstance(result, Exception):
+                logging.error(f"FAILED: {file_name} → {result}", exc_info=result)
+                writer.enqueue_ledger(file_id, "Error", str(result)[:200], file_name)
+                outcome[file_id] = result
+                continue
 
-        logging.info(f"SUCCESS: {file_name}")
+            writer.enqueue(result, file_id)
+            writer.enqueue_ledger(file_id, "Processed", "Success", file_name)
+            logging.info(f"SUCCESS: {file_name}")
+            outcome[file_id] = None
 
-    except Exception as e:
-        logging.error(f"FAILED: {file_name} → {e}", exc_info=True)
-        import sheets
-        sheets.update_ledger(gsheets_sheet, file_id, "Error", str(e)[:200], config, file_name)
+    return outcome
 
-    finally:
-        if os.path.exists(local_path):
-            try:
-                os.remove(local_path)
-            except Exception:
-                pass
@@ -1,15 +1,34 @@
 import os
-import json
+# Pin native thread pools (BLAS/OpenMP used by chromadb/numpy) to one
+# thread before they load: concurrent requests then spread across cores
+# instead of each fanning out over all of them.
+for _var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+    os.environ.setdefault(_var, "1")
+
+import asyncio
+import re
+import hashlib
+import io
 import logging
+import random
+import tarfile
+import threading
 import time # Import the time module for handling rate limits
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from urllib.request import urlopen
+
+import numpy as np
+import orjson
+
 import google.generativeai as genai
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-import chromadb
-from chromadb.utils import embedding_functions
+from google.api_core.exceptions import ResourceExhausted
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 
 # --- Basic Setup ---
-app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
 
 # --- Configuration & Secrets ---
@@ -19,24 +38,431 @@ if not GEMINI_API_KEY:
     raise RuntimeError("GEMINI_API_KEY environment variable must be set.")
 logging.info("GEMINI_API_KEY loaded successfully.")
 
-# --- CORS Configuration ---
-CORS(app, resources={r"/*": {"origins": "*"}})
-
 # --- AI & Vector DB Setup (The Core of the RAG Model) ---
 genai.configure(api_key=GEMINI_API_KEY)
 
 # --- MEMORY FIX ---
 # This now uses the lightweight Gemini API for embeddings instead of a heavy local model.
 # This is the key change that solves the "Out of memory" error.
-gemini_ef = embedding_functions.GoogleGenerativeAiEmbeddingFunction(api_key=GEMINI_API_KEY)
+EMBED_MODEL = os.environ.get("CHAT_EMBED_MODEL", "models/text-embedding-004")
+EMBED_TASK = "retrieval_document"
+QUERY_TASK = "retrieval_query"     # asymmetric retrieval: questions use the query task
+# 256 dims instead of the full 768: short meeting summaries rank just as
+# well and every vector is 3x smaller in the index and in each search.
+# Truncated vectors are re-normalized to unit length. 0 = the model's full size.
+EMBED_DIM = int(os.environ.get("CHAT_EMBED_DIM", "256"))
+_EMBED_KWARGS = {"output_dimensionality": EMBED_DIM} if EMBED_DIM else {}
+
+# --- Optional Local Embedder ---
+# CHAT_EMBEDDER=meanword swaps the API for mean-pooled word vectors: the
+# indexed docs are short "Owner: X. Society: Y. ..." strings, where this
+# is good enough and encodes in ~1 ms on CPU with no rate limits.
+_TOKEN = re.compile(r"[a-z0-9]+")
+EMBED_CHUNK = 256   # min texts per thread when embedding locally
+
+def _embed_parallel(embed_many, texts):
+    """Split a large batch across a thread pool (numpy / ONNX Runtime release
+    the GIL); small batches run inline. Returns a list of vectors."""
+    texts = list(texts)
+    workers = min(os.cpu_count() or 1, len(texts) // EMBED_CHUNK)
+    if workers < 2:
+        return embed_many(texts).tolist()
+    size = -(-len(texts) // workers)
+    chunks = [texts[i:i + size] for i in range(0, len(texts), size)]
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        return np.concatenate(list(ex.map(embed_many, chunks))).tolist()
+
+class MeanWordEmbedder:
+    """Unit-normalized mean of pretrained word vectors (e.g. GloVe 300d),
+    loaded from an .npz holding `words` and `vectors` arrays."""
+
+    def __init__(self, path):
+        data = np.load(path, allow_pickle=False)
+        self.vectors = data["vectors"].astype(np.float32)
+        self.index = {w: i for i, w in enumerate(data["words"].tolist())}
+        self.dim = self.vectors.shape[1]
+        self.name = f"meanword-{self.dim}d"
+
+    def embed(self, text):
+        rows = [self.index[t] for t in _TOKEN.findall(text.lower()) if t in self.index]
+        if not rows:
+            return np.zeros(self.dim, dtype=np.float32)
+        v = self.vectors[rows].mean(axis=0)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    embed_query = embed
+
+    def _embed_many(self, texts):
+        # One gather + segment sum for the whole chunk instead of a
+        # Python-level mean per text; both run in numpy with the GIL released.
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        rows, starts, hit = [], [], []
+        for i, t in enumerate(texts):
+            r = [self.index[w] for w in _TOKEN.findall(t.lower()) if w in self.index]
+            if r:
+                starts.append(len(rows))
+                rows.extend(r)
+                hit.append(i)
+        if hit:
+            sums = np.add.reduceat(self.vectors[rows], starts, axis=0)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            out[hit] = sums / np.where(norms > 0, norms, 1)
+        return out
+
+    def __call__(self, texts):
+        return _embed_parallel(self._embed_many, texts)
+
+# CHAT_EMBEDDER=onnx runs a small sentence model locally through ONNX
+# Runtime (optional deps: onnxruntime, tokenizers). ONNX_MODEL_DIR holds an
+# export of e.g. BAAI/bge-small-en-v1.5: tokenizer.json plus an int8
+# model_quantized.onnx (ONNX_MODEL_FILE to use another file).
+class OnnxEmbedder:
+    """CLS-pooled, unit-normalized embeddings from a BERT-style ONNX model.
+    Questions get the bge retrieval instruction prepended."""
+
+    QUERY_PREFIX = "Represent this sentence for searching relevant passages: "
+    BATCH = 32
+
+    def __init__(self, model_dir):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        opts = ort.SessionOptions()
+        # One thread per session: parallelism comes from _embed_parallel / workers
+        opts.intra_op_num_threads = int(os.environ.get("ORT_NUM_THREADS", "1"))
+        model_file = os.environ.get("ONNX_MODEL_FILE", "model_quantized.onnx")
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, model_file), opts, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=512)
+        self.tokenizer.enable_padding()
+        self.dim = int(self._encode(["dim"]).shape[1])
+        self.name = f"onnx-{os.path.basename(os.path.normpath(model_dir))}-{model_file}"
+
+    def _encode(self, texts):
+        enc = self.tokenizer.encode_batch(texts)
+        feed = {
+            "input_ids": np.array([e.ids for e in enc], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in enc], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in enc], dtype=np.int64),
+        }
+        hidden = self.session.run(None, {k: v for k, v in feed.items() if k in self.input_names})[0]
+        cls = hidden[:, 0].astype(np.float32)
+        norms = np.linalg.norm(cls, axis=1, keepdims=True)
+        return cls / np.where(norms > 0, norms, 1)
+
+    def _embed_many(self, texts):
+        return np.concatenate([self._encode(texts[i:i + self.BATCH]) for i in range(0, len(texts), self.BATCH)])
+
+    def embed(self, text):
+        return self._encode([text])[0]
+
+    def embed_query(self, text):
+        return self.embed(self.QUERY_PREFIX + text)
+
+    def __call__(self, texts):
+        return _embed_parallel(self._embed_many, texts)
+
+CHAT_EMBEDDER = os.environ.get("CHAT_EMBEDDER", "gemini").lower()
+local_embedder = None
+try:
+    if CHAT_EMBEDDER == "meanword":
+        local_embedder = MeanWordEmbedder(os.environ.get("WORD_VECTORS_PATH", "word_vectors.npz"))
+    elif CHAT_EMBEDDER == "onnx":
+        local_embedder = OnnxEmbedder(os.environ.get("ONNX_MODEL_DIR", "models/bge-small-en-v1.5"))
+    if local_embedder is not None:
+        logging.info(f"Using local embedder {local_embedder.name} ({local_embedder.dim}d).")
+except Exception as e:
+    logging.warning(f"Could not load the {CHAT_EMBEDDER} embedder ({e}); falling back to Gemini embeddings.")
+    CHAT_EMBEDDER = "gemini"
+
+# --- Embedding Rate Limit ---
+class RateLimiter:
+    """Sliding-window limiter: at most `limit` units in any `window` seconds.
+    acquire() sleeps only as long as needed for the oldest units to expire."""
+
+    def __init__(self, limit, window=60.0):
+        self.limit = limit
+        self.window = window
+        self._stamps = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self, n=1):
+        if self.limit <= 0:
+            return
+        n = min(n, self.limit)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._stamps and now - self._stamps[0] >= self.window:
+                    self._stamps.popleft()
+                over = len(self._stamps) + n - self.limit
+                if over <= 0:
+                    self._stamps.extend([now] * n)
+                    return
+                wait = self.window - (now - self._stamps[over - 1])
+            time.sleep(wait)
+
+# Counted per embedded text (the API bills a batch request per item).
+EMBED_LIMITER = RateLimiter(int(os.environ.get("GEMINI_EMBED_RPM", "1500")))
+EMBED_ATTEMPTS = 5
+
+def _retry_after(exc):
+    """Seconds from a 429's Retry-After header, if the error carries one."""
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+def embed_documents(documents):
+    """Embed a list of texts in one batch request."""
+    if local_embedder is not None:
+        return local_embedder(documents)
+    documents = list(documents)
+    for attempt in range(EMBED_ATTEMPTS):
+        EMBED_LIMITER.acquire(len(documents))
+        try:
+            result = genai.embed_content(
+                model=EMBED_MODEL, content=documents, task_type=EMBED_TASK, **_EMBED_KWARGS
+            )
+            return [_unit(v).tolist() for v in result["embedding"]]
+        except ResourceExhausted as e:
+            if attempt == EMBED_ATTEMPTS - 1:
+                raise
+            delay = _retry_after(e) or min(8.0, 2 ** attempt) + random.uniform(0, 0.5)
+            logging.warning("Embedding rate-limited; retrying in %.1fs...", delay)
+            time.sleep(delay)
 
-# --- PERMISSION FIX ---
-# Use an in-memory client. This avoids all filesystem permission errors on Render's free tier.
-client = chromadb.Client()
-collection = client.get_or_create_collection(
-    name="meetings_collection_gemini", 
-    embedding_function=gemini_ef
-)
+# --- RATE LIMIT FIX ---
+# Each Gemini request embeds up to EMBED_BATCH texts (the API max).
+# EMBED_WORKERS requests are in flight at once to overlap round-trips; all
+# of them draw from EMBED_LIMITER, so concurrency never exceeds the quota.
+EMBED_BATCH = 100
+EMBED_WORKERS = int(os.environ.get("GEMINI_EMBED_WORKERS", "4"))
+
+def _embed_jittered(texts):
+    time.sleep(random.uniform(0, 0.2))  # don't fire the first requests in lockstep
+    return embed_documents(texts)
+
+def embed_corpus(texts_by_key):
+    """Embed {key: text} → {key: vector}, batching and parallelizing API calls."""
+    keys = list(texts_by_key)
+    texts = [texts_by_key[k] for k in keys]
+    if local_embedder is not None:
+        return dict(zip(keys, local_embedder(texts)))
+
+    chunks = [texts[i:i + EMBED_BATCH] for i in range(0, len(texts), EMBED_BATCH)]
+    vectors = []
+    with ThreadPoolExecutor(max_workers=max(1, EMBED_WORKERS)) as ex:
+        futures = [ex.submit(_embed_jittered, chunk) for chunk in chunks]
+        try:
+            for n, fut in enumerate(futures, start=1):
+                vectors.extend(fut.result())
+                logging.info("Embedded batch %d/%d.", n, len(chunks))
+        except Exception:
+            for fut in futures:
+                fut.cancel()
+            raise
+    return dict(zip(keys, vectors))
+
+# --- Persistent Index ---
+# Embeddings survive restarts so a cold boot doesn't re-embed everything.
+# Falls back to /tmp when the disk mount isn't writable.
+DATA_PATH = "dashboard_data.json"
+COLLECTION_NAME = f"meetings_collection_{CHAT_EMBEDDER}"   # vectors differ per embedder
+
+def _chroma_dir():
+    path = os.environ.get("CHROMA_DIR", "/var/data/chroma")
+    try:
+        os.makedirs(path, exist_ok=True)
+        if os.access(path, os.W_OK):
+            return path
+    except OSError:
+        pass
+    logging.warning(f"CHROMA_DIR '{path}' is not writable; using /tmp/chroma instead.")
+    os.makedirs("/tmp/chroma", exist_ok=True)
+    return "/tmp/chroma"
+
+# --- Optional Flat Index ---
+# VECTOR_INDEX=numpy swaps Chroma for one L2-normalized float32 matrix:
+# at a few hundred meetings an exact V @ q + argpartition is microseconds,
+# with no HNSW graph or SQLite in the query path. Exposes the subset of
+# the Chroma collection API this module uses.
+class FlatIndex:
+    """Struct-of-arrays: one C-contiguous float32 matrix plus parallel
+    id/document/metadata lists; filterable fields are cached as arrays."""
+
+    def __init__(self, path):
+        self.path = path
+        self._vectors = None
+        self._pending = []      # batches added since the matrix was last built
+        self._columns = {}      # metadata field -> np.ndarray, for vectorized filters
+        self.ids, self.documents, self.metadatas = [], [], []
+        self.metadata = {}
+
+    @classmethod
+    def load(cls, path):
+        index = cls(path)
+        try:
+            with np.load(f"{path}.npz", allow_pickle=False) as data:
+                index._vectors = np.ascontiguousarray(data["vectors"], dtype=np.float32)
+            with open(f"{path}.json", "rb") as f:
+                state = orjson.loads(f.read())
+            index.ids, index.documents = state["ids"], state["documents"]
+            index.metadatas, index.metadata = state["metadatas"], state["metadata"]
+        except (OSError, KeyError, ValueError):
+            return cls(path)
+        return index
+
+    @property
+    def vectors(self):
+        # Concatenate pending batches once, not an np.vstack copy per add()
+        if self._pending:
+            parts = ([self._vectors] if self._vectors is not None else []) + self._pending
+            self._vectors = np.ascontiguousarray(np.concatenate(parts), dtype=np.float32)
+            self._pending = []
+        return self._vectors
+
+    def count(self):
+        return len(self.ids)
+
+    def add(self, documents, metadatas, ids, embeddings):
+        v = np.asarray(embeddings, dtype=np.float32)
+        v /= np.maximum(np.linalg.norm(v, axis=1, keepdims=True), 1e-12)
+        self._pending.append(v)
+        self._columns.clear()
+        self.ids += list(ids)
+        self.documents += list(documents)
+        self.metadatas += list(metadatas)
+
+    def upsert(self, documents, metadatas, ids, embeddings):
+        self.delete(ids)
+        self.add(documents=documents, metadatas=metadatas, ids=ids, embeddings=embeddings)
+
+    def get(self, include=None):
+        return {"ids": list(self.ids)}
+
+    def delete(self, ids):
+        drop = set(ids)
+        keep = [i for i, id_ in enumerate(self.ids) if id_ not in drop]
+        if len(keep) == len(self.ids):
+            return
+        if self.vectors is not None:
+            self._vectors = np.ascontiguousarray(self.vectors[keep])
+        self._columns.clear()
+        self.ids = [self.ids[i] for i in keep]
+        self.documents = [self.documents[i] for i in keep]
+        self.metadatas = [self.metadatas[i] for i in keep]
+
+    def _column(self, field):
+        col = self._columns.get(field)
+        if col is None:
+            col = np.array([m.get(field) for m in self.metadatas], dtype=object)
+            self._columns[field] = col
+        return col
+
+    def _mask(self, where):
+        """Supports {field: value} and {field: {"$in": [...]}}."""
+        if not where:
+            return None
+        (field, cond), = where.items()
+        allowed = list(cond["$in"]) if isinstance(cond, dict) else [cond]
+        return np.isin(self._column(field), allowed)
+
+    def query(self, query_embeddings, n_results=10, where=None):
+        out = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        if not self.ids:
+            for _ in query_embeddings:
+                for key in out:
+                    out[key].append([])
+            return out
+
+        V = self.vectors
+        Q = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        Q /= np.maximum(np.linalg.norm(Q, axis=1, keepdims=True), 1e-12)
+        S = Q @ V.T     # all queries scored in one BLAS call
+
+        mask = self._mask(where)
+        if mask is not None:
+            S[:, ~mask] = -np.inf
+        k = min(n_results, len(self.ids) if mask is None else int(mask.sum()))
+
+        for scores in S:
+            top = np.argpartition(-scores, k - 1)[:k] if k else np.array([], dtype=int)
+            top = top[np.argsort(-scores[top])]
+            out["ids"].append([self.ids[i] for i in top])
+            out["documents"].append([self.documents[i] for i in top])
+            out["metadatas"].append([self.metadatas[i] for i in top])
+            out["distances"].append((1.0 - scores[top]).tolist())
+        return out
+
+    def modify(self, metadata):
+        """Set metadata and persist; called once indexing is complete."""
+        self.metadata = dict(metadata)
+        vectors = self.vectors if self.vectors is not None else np.zeros((0, 0), np.float32)
+        with open(f"{self.path}.npz.tmp", "wb") as f:
+            np.savez(f, vectors=vectors)
+        with open(f"{self.path}.json.tmp", "wb") as f:
+            f.write(orjson.dumps({
+                "ids": self.ids, "documents": self.documents,
+                "metadatas": self.metadatas, "metadata": self.metadata,
+            }))
+        os.replace(f"{self.path}.npz.tmp", f"{self.path}.npz")
+        os.replace(f"{self.path}.json.tmp", f"{self.path}.json")
+
+VECTOR_INDEX = os.environ.get("VECTOR_INDEX", "chroma").lower()
+INDEX_DIR = _chroma_dir()
+
+# Prebuilt index (a build_index.py tarball; local path or http(s) URL).
+# Unpacked into an empty INDEX_DIR at boot so a fresh disk starts with
+# vectors instead of re-embedding; staleness is still checked by fingerprint.
+INDEX_ARCHIVE = os.environ.get("INDEX_ARCHIVE")
+# ALLOW_REINDEX=0 keeps the server from embedding at all: a stale index is
+# reported and served as-is until build_index.py produces a new one.
+ALLOW_REINDEX = os.environ.get("ALLOW_REINDEX", "1") != "0"
+
+def hydrate_index():
+    if not INDEX_ARCHIVE or os.listdir(INDEX_DIR):
+        return
+    try:
+        if INDEX_ARCHIVE.startswith(("http://", "https://")):
+            with urlopen(INDEX_ARCHIVE, timeout=120) as resp:
+                tar = tarfile.open(fileobj=io.BytesIO(resp.read()), mode="r:gz")
+        else:
+            tar = tarfile.open(INDEX_ARCHIVE, mode="r:gz")
+        with tar:
+            if hasattr(tarfile, "data_filter"):
+                tar.extractall(INDEX_DIR, filter="data")
+            else:
+                tar.extractall(INDEX_DIR)
+        logging.info(f"Unpacked prebuilt index from {INDEX_ARCHIVE}.")
+    except Exception as e:
+        logging.warning(f"Could not unpack INDEX_ARCHIVE ({e}); will index from scratch.")
+
+def open_collection(fresh=False):
+    """Return the vector index for COLLECTION_NAME; `fresh` drops any existing one."""
+    if VECTOR_INDEX == "numpy":
+        path = os.path.join(INDEX_DIR, COLLECTION_NAME)
+        return FlatIndex(path) if fresh else FlatIndex.load(path)
+    # chromadb (sqlite, onnxruntime, its own telemetry stack) is only
+    # imported when it's the selected index: the numpy index boots without it.
+    global client
+    if client is None:
+        import chromadb
+        client = chromadb.PersistentClient(path=INDEX_DIR)
+    if fresh:
+        client.delete_collection(COLLECTION_NAME)
+    # Vectors are always computed here and passed in (embed_corpus /
+    # embed_query); without an embedding function Chroma never embeds itself.
+    return client.get_or_create_collection(name=COLLECTION_NAME, embedding_function=None)
+
+hydrate_index()
+client = None
+collection = open_collection()
 
 # --- The "Brain" of the Chatbot: The System Prompt ---
 SYSTEM_PROMPT = """You are InsightBot, an expert sales analyst. Your task is to answer the user's QUESTION based *only* on the provided JSON data in the CONTEXT.
@@ -48,24 +474,214 @@ SYSTEM_PROMPT = """You are InsightBot, an expert sales analyst. Your task is to
 - **Data Scarcity:** If the context does not contain the answer, you MUST state that the information is not available in the provided records. Do not invent information.
 """
 
+# --- Answer Cache ---
+# Exact hits on the normalized question skip retrieval and generation.
+# Deliberately no similarity matching: "top 3" vs "top 5", or the same
+# question about two reps, embed almost identically but need different
+# answers. Oldest entries are evicted first.
+ANSWER_CACHE_SIZE = 512
+
+_answer_cache = OrderedDict()   # normalized question -> answer
+
+def _normalize_question(question):
+    return " ".join(question.lower().split())
+
+def _unit(vec):
+    v = np.asarray(vec, dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return v / norm if norm else v
+
+def cached_answer(key):
+    answer = _answer_cache.get(key)
+    if answer is not None:
+        _answer_cache.move_to_end(key)
+    return answer
+
+def store_answer(key, answer):
+    _answer_cache[key] = answer
+    _answer_cache.move_to_end(key)
+    while len(_answer_cache) > ANSWER_CACHE_SIZE:
+        _answer_cache.popitem(last=False)
+
+# Retrieval results per normalized question, so a retry after a failed
+# generation (rate limit, timeout) skips the embedding call and the query.
+RETRIEVAL_CACHE_SIZE = 1024
+_retrieval_cache = OrderedDict()   # normalized question -> context_str
+
+def cached_retrieval(key):
+    hit = _retrieval_cache.get(key)
+    if hit is not None:
+        _retrieval_cache.move_to_end(key)
+    return hit
+
+def store_retrieval(key, context_str):
+    _retrieval_cache[key] = context_str
+    _retrieval_cache.move_to_end(key)
+    while len(_retrieval_cache) > RETRIEVAL_CACHE_SIZE:
+        _retrieval_cache.popitem(last=False)
+
+def embed_query(question):
+    if local_embedder is not None:
+        return local_embedder.embed_query(question).tolist()
+    result = genai.embed_content(model=EMBED_MODEL, content=question, task_type=QUERY_TASK, **_EMBED_KWARGS)
+    return _unit(result["embedding"]).tolist()
+
+async def embed_query_async(question):
+    """Native async embed: the request awaits the API without holding a
+    worker thread (the local embedder is CPU-only and stays inline)."""
+    if local_embedder is not None:
+        return local_embedder.embed_query(question).tolist()
+    result = await genai.embed_content_async(
+        model=EMBED_MODEL, content=question, task_type=QUERY_TASK, **_EMBED_KWARGS
+    )
+    return _unit(result["embedding"]).tolist()
+
+# --- Name Prefilter ---
+# Direct questions name a society ("deal status for DLF Crest") or a rep;
+# embeddings rank proper nouns poorly, so match names exactly first.
+# Society Name is the recording's file stem, "<society> l <type> l <city> l <date>".
+MIN_NAME_LEN = 4
+OWNER_FIELD = "Owner (Who handled the meeting)"
+
+society_index = {}   # normalized society -> [record ids]
+owner_names = {}     # normalized owner -> owner value as stored
+
+def _name_key(text):
+    return " ".join(_TOKEN.findall(str(text).lower()))
+
+def build_name_index(meetings, ids):
+    society_index.clear()
+    owner_names.clear()
+    for id_, m in zip(ids, meetings):
+        society = _name_key(str(m.get("Society Name") or "").split(" l ")[0])
+        if len(society) >= MIN_NAME_LEN:
+            society_index.setdefault(society, []).append(id_)
+        owner = m.get(OWNER_FIELD)
+        if owner and len(_name_key(owner)) >= MIN_NAME_LEN:
+            owner_names[_name_key(owner)] = owner
+
+def _longest_matches(keys, q):
+    hits = [k for k in keys if f" {k} " in q]
+    # "rahul a" beats "rahul" when both match
+    return [k for k in hits if not any(k != o and f" {k} " in f" {o} " for o in hits)]
+
+def match_names(question):
+    """Returns (record ids of named societies, stored names of named owners)."""
+    q = f" {_name_key(question)} "
+    ids = [i for k in _longest_matches(society_index, q) for i in society_index[k]]
+    owners = [owner_names[k] for k in _longest_matches(owner_names, q)]
+    return ids, owners
+
+# --- Pre-serialized Records ---
+# id -> record (and its compact JSON, built once at load so /chat only
+# joins strings). Compact: indentation only costs prompt tokens.
+records = {}
+records_json = {}
+
+# Questions about one aspect only need that column, on top of the core
+# who/where/when/score columns that mixed questions ("Ravi's score and what
+# he missed") still lean on
+CORE_FIELDS = ["Society Name", OWNER_FIELD, "Date", "% Score", "Manager"]
+FIELD_HINTS = {
+    "improve": ["Improvement Areas", "Improvements Needed"],
+    "miss": ["Missed Opportunities", "Suggestions & Missed Topics"],
+    "risk": ["Risks / Unresolved Issues"],
+    "status": ["Deal Status"],
+}
+
+def hinted_fields(question):
+    """CORE_FIELDS plus the FIELD_HINTS columns whose keyword appears, else None (all fields)."""
+    q = question.lower()
+    fields = []
+    for keyword, cols in FIELD_HINTS.items():
+        if keyword in q:
+            fields += [c for c in cols if c not in fields]
+    return CORE_FIELDS + fields if fields else None
+
+def build_context_str(ids, metadatas, fields=None):
+    if not ids:
+        return "[]"
+    if fields:
+        rows = [records.get(id_) or meta for id_, meta in zip(ids, metadatas)]
+        return orjson.dumps([{k: r.get(k) for k in fields} for r in rows]).decode()
+    parts = [records_json.get(id_) or orjson.dumps(meta).decode() for id_, meta in zip(ids, metadatas)]
+    return "[" + ",".join(parts) + "]"
+
 def batch_generator(data, batch_size):
     """Yields successive n-sized chunks from a list."""
     for i in range(0, len(data), batch_size):
         yield data[i:i + batch_size]
 
+# Part of the index fingerprint next to the data hash: a different
+# embedder/model or document format must rebuild even if the data didn't
+# change. Bump DOC_FORMAT when the document text below changes.
+DOC_FORMAT = 1
+
+def _index_version():
+    model = f"{EMBED_MODEL}@{EMBED_DIM or 'full'}" if local_embedder is None else local_embedder.name
+    return f"{model}|doc{DOC_FORMAT}"
+
+INDEX_VERSION = _index_version()
+
+def record_ids(meetings):
+    """Deterministic ids from each record's content: an unchanged meeting
+    keeps its id (and its vector) across data refreshes. Identical records
+    get an occurrence suffix so none are dropped."""
+    ids, seen = [], {}
+    for m in meetings:
+        digest = hashlib.sha1(orjson.dumps(m, option=orjson.OPT_SORT_KEYS)).hexdigest()[:16]
+        n = seen[digest] = seen.get(digest, -1) + 1
+        ids.append(digest if n == 0 else f"{digest}-{n}")
+    return ids
+
 def load_and_index_data():
-    """Loads data and indexes it in batches to avoid API rate limiting on startup."""
+    """Loads data and indexes it in batches to avoid API rate limiting on startup.
+    Skips indexing when the persisted index was built from the same file;
+    otherwise only new/changed records are embedded and removed ones deleted.
+    Returns True when the index is up to date afterwards."""
+    global collection
     try:
-        if collection.count() > 0:
-            logging.info(f"Index already contains {collection.count()} records. Skipping re-indexing.")
-            return
+        with open(DATA_PATH, "rb") as f:
+            raw = f.read()
+        source_md5 = hashlib.md5(raw).hexdigest()
+        all_meetings = orjson.loads(raw)
+        ids = record_ids(all_meetings)
+        records.clear()
+        records.update(zip(ids, all_meetings))
+        records_json.clear()
+        records_json.update((id_, orjson.dumps(m).decode()) for id_, m in records.items())
+        _retrieval_cache.clear()
+        _answer_cache.clear()
+        build_name_index(all_meetings, ids)
+
+        stored = collection.metadata or {}
+        if (stored.get("source_md5") == source_md5
+                and stored.get("index_version") == INDEX_VERSION
+                and collection.count() == len(all_meetings)):
+            logging.info("Index already contains %d records. Skipping re-indexing.", len(all_meetings))
+            return True
 
-        logging.info("In-memory index is empty. Starting one-time batch indexing process...")
-        with open("dashboard_data.json", "r", encoding="utf-8") as f:
-            all_meetings = json.load(f)
+        if not ALLOW_REINDEX:
+            logging.error("Index is missing or stale and ALLOW_REINDEX=0; run build_index.py to rebuild it.")
+            return False
+
+        if stored.get("index_version") != INDEX_VERSION:
+            # Different embedder or document format: no vector can be reused
+            logging.info("Index is missing or was built differently. Starting full indexing...")
+            collection = open_collection(fresh=True)
+            existing = set()
+        else:
+            # Data changed (or a previous build was interrupted): only the delta
+            existing = set(collection.get(include=[])["ids"])
+            removed = list(existing - set(ids))
+            if removed:
+                collection.delete(ids=removed)
+            logging.info(f"Index is stale. Updating incrementally ({len(removed)} removed)...")
 
         all_docs = []
-        for i, meeting in enumerate(all_meetings):
+        for id_, meeting in zip(ids, all_meetings):
+            if id_ in existing:
+                continue
             doc_text = (
                 f"Owner: {meeting.get('Owner (Who handled the meeting)')}. "
                 f"Society: {meeting.get('Society Name')}. "
@@ -75,68 +691,192 @@ def load_and_index_data():
                 f"Improvements needed: '{meeting.get('Improvement Areas', 'N/A')}'. "
                 f"Missed opportunities: '{meeting.get('Missed Opportunities', 'N/A')}'."
             )
-            all_docs.append({'id': str(i), 'document': doc_text, 'metadata': meeting})
+            all_docs.append({'id': id_, 'document': doc_text, 'metadata': meeting})
+
+        # Identical document texts (re-uploaded recordings, boilerplate
+        # rows) are embedded once and share the vector.
+        hashes = [hashlib.sha1(d['document'].encode("utf-8")).hexdigest() for d in all_docs]
+        vectors = embed_corpus(dict(zip(hashes, (d['document'] for d in all_docs))))
+
+        # Vectors are precomputed, so the rows go in as few adds (transactions)
+        # as Chroma allows: usually one. The numpy index takes them all at once.
+        BATCH_SIZE = client.get_max_batch_size() if client is not None else max(1, len(all_docs))
+        for batch in batch_generator(list(zip(all_docs, hashes)), BATCH_SIZE):
+            collection.upsert(
+                documents=[item['document'] for item, _ in batch],
+                metadatas=[item['metadata'] for item, _ in batch],
+                ids=[item['id'] for item, _ in batch],
+                embeddings=[vectors[h] for _, h in batch],
+            )
+        logging.info(f"Indexed {len(all_docs)} new/changed records ({len(vectors)} embedded).")
+
+        # Mark the index complete only once every batch is in
+        collection.modify(metadata={"source_md5": source_md5, "index_version": INDEX_VERSION})
+        logging.info("Successfully indexed all meeting records.")
+        return True
 
-        # --- RATE LIMIT FIX ---
-        # Process in small batches with a delay to stay within the Gemini API's free tier limits.
-        BATCH_SIZE = 20
-        DELAY_SECONDS = 20 # A safe delay to respect free tier limits
-        
-        batch_num = 1
-        for batch in batch_generator(all_docs, BATCH_SIZE):
-            logging.info(f"Processing batch {batch_num} ({len(batch)} documents)...")
-            ids = [item['id'] for item in batch]
-            documents = [item['document'] for item in batch]
-            metadatas = [item['metadata'] for item in batch]
-            
-            collection.add(documents=documents, metadatas=metadatas, ids=ids)
-            
-            logging.info(f"Batch {batch_num} indexed. Waiting for {DELAY_SECONDS} seconds...")
-            time.sleep(DELAY_SECONDS)
-            batch_num += 1
-
-        logging.info("Successfully indexed all meeting records into memory.")
-        
     except FileNotFoundError:
-        logging.error(f"CRITICAL: 'dashboard_data.json' not found. Chatbot will have no context.")
+        logging.error(f"CRITICAL: '{DATA_PATH}' not found. Chatbot will have no context.")
     except Exception as e:
         logging.error(f"An error occurred during data loading/indexing: {e}", exc_info=True)
+    return False
+
+
+def warmup():
+    """Touch the embedder, vector index and Gemini client once so the first
+    real /chat doesn't pay for connection setup and index loading."""
+    try:
+        vec = embed_query("warmup")
+        collection.query(query_embeddings=[vec], n_results=1)
+        GEN_MODEL.count_tokens("warmup")
+        logging.info("Warmup complete.")
+    except Exception as e:
+        logging.warning(f"Warmup skipped: {e}")
+
+
+# --- App & CORS Configuration ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Indexing sleeps between batches; keep it off the event loop.
+    await asyncio.to_thread(load_and_index_data)
+    await asyncio.to_thread(warmup)
+    yield
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+
+
+CHAT_MODEL = "gemini-2.5-flash-preview-05-20"
+# One model for all requests: its client and connection pool are reused
+# instead of being set up again on every /chat call. The fixed instructions
+# ride along as system_instruction, so each prompt carries only the
+# per-question CONTEXT and QUESTION.
+GEN_MODEL = genai.GenerativeModel(CHAT_MODEL, system_instruction=SYSTEM_PROMPT)
+FALLBACK_ANSWER = "Sorry, I couldn’t produce an answer."
+UNAVAILABLE_DETAIL = "The AI service is currently unavailable. This might be due to a rate limit."
+
+async def _read_question(request):
+    try:
+        data = await request.json()
+    except Exception:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    return (data.get("question") or "").strip()
+
+async def _prepare_answer(question):
+    """Returns (cached_answer, None, None) on a cache hit, otherwise
+    (None, prompt, cache_key) for the generation step."""
+    cache_key = _normalize_question(question)
+    answer = cached_answer(cache_key)
+    if answer is not None:
+        return answer, None, None
+
+    society_ids, owners = match_names(question)
+    if society_ids:
+        # Named society: its records are the context, no embedding needed
+        ids = society_ids[:15]
+        context_str = build_context_str(ids, [{}] * len(ids), hinted_fields(question))
+        prompt = f"CONTEXT:\n{context_str}\n\nQUESTION:\n{question}\n\nANSWER:"
+        return None, prompt, cache_key
+
+    context_str = cached_retrieval(cache_key)
+    if context_str is None:
+        query_vec = await embed_query_async(question)
 
+        # Named rep(s): rank only their meetings
+        where = None
+        if owners:
+            where = {OWNER_FIELD: owners[0]} if len(owners) == 1 else {OWNER_FIELD: {"$in": owners}}
 
-@app.route("/chat", methods=["POST"])
-def chat():
-    data = request.get_json(silent=True) or {}
-    question = (data.get("question") or "").strip()
+        # RAG - RETRIEVAL (Chroma's client is sync; run it off the event loop)
+        results = await asyncio.to_thread(collection.query, query_embeddings=[query_vec], n_results=15, where=where)
+        context_str = build_context_str(
+            results.get('ids', [[]])[0], results.get('metadatas', [[]])[0], hinted_fields(question)
+        )
+        store_retrieval(cache_key, context_str)
+
+    prompt = f"CONTEXT:\n{context_str}\n\nQUESTION:\n{question}\n\nANSWER:"
+    return None, prompt, cache_key
+
+@app.post("/chat")
+async def chat(request: Request):
+    question = await _read_question(request)
     if not question:
-        return jsonify({"error": "Missing 'question'"}), 400
+        return JSONResponse({"error": "Missing 'question'"}, status_code=400)
 
     try:
-        # RAG - RETRIEVAL
-        results = collection.query(query_texts=[question], n_results=15)
-        context_data = results.get('metadatas', [[]])[0]
-        context_str = json.dumps(context_data, indent=2) if context_data else "[]"
-        
+        answer, prompt, cache_key = await _prepare_answer(question)
+        if answer is not None:
+            return {"answer": answer}
+
         # RAG - GENERATION (using Gemini)
-        prompt = f"{SYSTEM_PROMPT}\n\nCONTEXT:\n{context_str}\n\nQUESTION:\n{question}\n\nANSWER:"
-        model = genai.GenerativeModel("gemini-2.5-flash-preview-05-20")
-        resp = model.generate_content(prompt)
+        resp = await GEN_MODEL.generate_content_async(prompt)
         
-        text = getattr(resp, "text", "") or "Sorry, I couldn’t produce an answer."
-        return jsonify({"answer": text})
+        text = getattr(resp, "text", "")
+        if not text:
+            return {"answer": FALLBACK_ANSWER}
+
+        store_answer(cache_key, text)
+        return {"answer": text}
 
     except Exception as e:
-        logging.error(f"Chat processing error: {e}")
-        detail = "The AI service is currently unavailable. This might be due to a rate limit."
-        return jsonify({"error": "Failed to process chat request.", "detail": detail}), 500
+        logging.error("Chat processing error: %s", e)
+        return JSONResponse({"error": "Failed to process chat request.", "detail": UNAVAILABLE_DETAIL}, status_code=500)
+
+def _sse(payload):
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(request: Request):
+    """Same as /chat, but as server-sent events: {"delta": text} chunks as
+    Gemini produces them, then {"done": true} (or {"error": ...})."""
+    question = await _read_question(request)
+    if not question:
+        return JSONResponse({"error": "Missing 'question'"}, status_code=400)
+
+    async def events():
+        try:
+            answer, prompt, cache_key = await _prepare_answer(question)
+            if answer is not None:
+                yield _sse({"delta": answer})
+                yield _sse({"done": True})
+                return
+
+            resp = await GEN_MODEL.generate_content_async(prompt, stream=True)
+
+            parts = []
+            async for chunk in resp:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    continue  # e.g. a finish-only chunk
+                if text:
+                    parts.append(text)
+                    yield _sse({"delta": text})
+
+            if parts:
+                store_answer(cache_key, "".join(parts))
+            else:
+                yield _sse({"delta": FALLBACK_ANSWER})
+            yield _sse({"done": True})
+
+        except Exception as e:
+            logging.error("Chat stream error: %s", e)
+            yield _sse({"error": "Failed to process chat request.", "detail": UNAVAILABLE_DETAIL})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # --- Health Check ---
-@app.route("/ping", methods=["GET"])
-def ping():
-    return jsonify({"status": "Backend is alive"})
+@app.get("/ping")
+async def ping():
+    return {"status": "Backend is alive"}
 
 if __name__ == "__main__":
-    load_and_index_data()
+    import uvicorn
     port = int(os.environ.get("PORT", 8080))
-    from waitress import serve
-    serve(app, host="0.0.0.0", port=port)
-
+    uvicorn.run(app, host="0.0.0.0", port=port)
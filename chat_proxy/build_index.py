@@ -0,0 +1,37 @@
+# ===================================================================
+# build_index.py — Build the chat index offline and package it
+# ===================================================================
+# Embeds dashboard_data.json into the persisted index (CHROMA_DIR, same
+# VECTOR_INDEX / CHAT_EMBEDDER settings as the server) and optionally
+# writes a tarball for the server's INDEX_ARCHIVE, so boots skip indexing.
+#
+#   GEMINI_API_KEY=... CHROMA_DIR=build/index python build_index.py --archive index.tar.gz
+
+import argparse
+import os
+import sys
+import tarfile
+
+os.environ["ALLOW_REINDEX"] = "1"   # this is the job that's allowed to embed
+os.environ.pop("INDEX_ARCHIVE", None)
+
+import app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the chat index offline.")
+    parser.add_argument("--archive", help="write the built index to this .tar.gz")
+    args = parser.parse_args()
+
+    if not app.load_and_index_data():
+        sys.exit("Index build failed; see log above.")
+
+    if args.archive:
+        with tarfile.open(args.archive, "w:gz") as tar:
+            for name in sorted(os.listdir(app.INDEX_DIR)):
+                tar.add(os.path.join(app.INDEX_DIR, name), arcname=name)
+        print(f"Wrote {args.archive} from {app.INDEX_DIR}")
+
+
+if __name__ == "__main__":
+    main()
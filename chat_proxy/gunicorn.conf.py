@@ -0,0 +1,46 @@
+# gunicorn.conf.py — production server for the chat proxy.
+# Run with: gunicorn -c gunicorn.conf.py app:app
+import os
+import subprocess
+import sys
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+
+# One uvicorn event loop per process; native thread pools are pinned to one
+# thread in app.py. Every worker holds its own copy of genai, numpy, chromadb
+# and all records, so the default stays at 2 (or fewer usable CPUs) to fit
+# small memory-limited instances; raise WEB_CONCURRENCY where RAM allows.
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.environ.get("WEB_CONCURRENCY", min(len(os.sched_getaffinity(0)), 2)))
+
+# The first boot may spend minutes embedding before workers answer.
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+# No preload_app: gRPC (Gemini) and SQLite (Chroma) handles don't survive a
+# fork, so each worker imports app.py itself.
+
+
+def on_starting(server):
+    """
+    Build the persisted index once, before any worker starts. Runs in a
+    child process so the master never opens gRPC/SQLite handles; each
+    worker's startup then finds the index up to date and only loads the
+    records.
+
+    Workers never write the index themselves (ALLOW_REINDEX=0 is inherited
+    through the fork): concurrent rebuilds would drop each other's
+    collection, and a reindex in a worker's lifespan races the `timeout` kill.
+    """
+    server.log.info("Building chat index before starting workers...")
+    result = subprocess.run(
+        [sys.executable, "-c", "import app, sys; sys.exit(0 if app.load_and_index_data() else 1)"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode != 0:
+        server.log.warning(
+            f"Index build exited with {result.returncode}; workers will serve the existing "
+            "index as-is (restart or run build_index.py to rebuild)."
+        )
+    os.environ["ALLOW_REINDEX"] = "0"
@@ -0,0 +1,54 @@
+# ===================================================================
+# config_index.py — Lookups derived once from config.yaml
+# ===================================================================
+
+from typing import Dict
+
+import yaml
+
+# libyaml's C parser when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
+# member folder name → {"Manager", "Team", "Email Id", "Manager Email"}
+MANAGER_INFO: Dict[str, Dict[str, str]] = {}
+
+
+def build_manager_info(config: Dict) -> Dict[str, Dict[str, str]]:
+    """
+    Flatten manager_map + manager_emails into one row of sheet values per
+    team member, so per-file enrichment is a single dict lookup.
+    """
+    manager_emails = config.get("manager_emails", {}) or {}
+    info: Dict[str, Dict[str, str]] = {}
+
+    for member, mm in (config.get("manager_map", {}) or {}).items():
+        mm = mm or {}
+        manager = mm.get("Manager", "N/A")
+        info[str(member)] = {
+            "Manager": manager,
+            "Team": mm.get("Team", "N/A"),
+            "Email Id": mm.get("Email", "N/A"),
+            "Manager Email": manager_emails.get(manager, "N/A"),
+        }
+
+    return info
+
+
+def index_config(config: Dict) -> Dict:
+    """Rebuild the module-level lookups from an already-loaded config."""
+    MANAGER_INFO.clear()
+    MANAGER_INFO.update(build_manager_info(config))
+    return config
+
+
+def read_config(path: str) -> Dict:
+    """Parse a YAML config file (safe loader semantics)."""
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.load(f, Loader=_YamlLoader)
+
+
+def load_config(path: str) -> Dict:
+    return index_config(read_config(path))
@@ -3,24 +3,21 @@
 
 import os
 import re
-import yaml
 import json
 import time
+import hashlib
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from functools import lru_cache
 from typing import Dict, List, Any, Tuple, Optional
 from datetime import datetime, timedelta
 
-import gspread
-from google.oauth2 import service_account
-
-# Try to import Gemini; runs fine without it
-try:
-    import google.generativeai as genai
-except Exception:
-    genai = None
+import numpy as np
 
 # local modules
-import sheets
+import config_index
 import email_formatter
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s", force=True)
@@ -34,6 +31,10 @@ def authenticate_google_sheets(config: Dict):
     if not gcp_key_str:
         raise ValueError("Missing GCP_SA_KEY environment variable")
 
+    # Imported here so a disabled or keyless run never loads the Google SDKs
+    import gspread
+    from google.oauth2 import service_account
+
     creds_info = json.loads(gcp_key_str)
     scopes = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
     creds = service_account.Credentials.from_service_account_info(creds_info, scopes=scopes)
@@ -46,10 +47,12 @@ def authenticate_google_sheets(config: Dict):
 # -----------------------
 # Parsing helpers
 # -----------------------
+# Tried in order; ISO first since the analysis prompt writes YYYY-MM-DD
+# (no other shape can match it, so the d/m vs m/d precedence is unchanged).
 _DATE_FORMATS = [
+    "%Y-%m-%d",    # 2025-12-13
     "%d/%m/%y",    # 13/12/25
     "%d/%m/%Y",    # 13/12/2025
-    "%Y-%m-%d",    # 2025-12-13
     "%d-%m-%Y",    # 13-12-2025
     "%m/%d/%Y",    # 12/13/2025
     "%Y/%m/%d",    # 2025/12/13
@@ -66,11 +69,35 @@ _DATE_FORMATS = [
     "%d-%m-%Y %H:%M",
 ]
 
+def _date_shape(s: str) -> Tuple[bool, bool]:
+    """(has a month name, has a time) — a format can only match strings of its own shape."""
+    return any(c.isalpha() for c in s), ":" in s
+
+# _DATE_FORMATS split by shape, each keeping the original order, so a string
+# is only tried against formats that could accept it
+_FORMATS_BY_SHAPE: Dict[Tuple[bool, bool], List[str]] = defaultdict(list)
+for _fmt in _DATE_FORMATS:
+    _FORMATS_BY_SHAPE[("%b" in _fmt, ":" in _fmt)].append(_fmt)
+del _fmt
+
+# Purely numeric dates (optionally with a time), parsed by regex instead of
+# strptime. Each shape maps to the first _DATE_FORMATS entry that would accept
+# it; anything else (invalid values, m/d/Y, month names) drops to the format loop.
+_TIME_PART = r"(?:(?P<tsep>,?\s+)(?P<H>\d{1,2}):(?P<M>\d{1,2})(?::(?P<S>\d{1,2}))?)?"
+_ISO_DATE_RE = re.compile(r"(?P<y>\d{4})(?P<sep>[-/])(?P<m>\d{1,2})(?P=sep)(?P<d>\d{1,2})" + _TIME_PART, re.ASCII)
+_DMY_DATE_RE = re.compile(r"(?P<d>\d{1,2})(?P<sep>[-/])(?P<m>\d{1,2})(?P=sep)(?P<y>\d{4}|\d{2})" + _TIME_PART, re.ASCII)
+
+_PUNCT_RE = re.compile(r"[^\w\s]")
+# ASCII chars _PUNCT_RE removes, for str.translate on all-ASCII text
+_ASCII_PUNCT_TABLE = {c: None for c in range(128) if _PUNCT_RE.match(chr(c))}
+_PERCENT_RE = re.compile(r"[-+]?\d*\.?\d+")
+_AMOUNT_RE = re.compile(r"[-+]?\d[\d,]*\.?\d*")
+
 def _normalize_text(s: Any) -> str:
     """Lowercase + trim + collapse whitespace + remove most punctuation for matching."""
-    x = str(s or "").strip().lower()
-    x = re.sub(r"\s+", " ", x)
-    x = re.sub(r"[^\w\s]", "", x)  # remove punctuation
+    x = " ".join(str(s or "").lower().split())
+    # remove punctuation; translate is a plain C loop for the usual ASCII names
+    x = x.translate(_ASCII_PUNCT_TABLE) if x.isascii() else _PUNCT_RE.sub("", x)
     x = x.strip()
     return x
 
@@ -85,8 +112,11 @@ def _parse_date(d: Any) -> Optional[datetime]:
         return None
     if isinstance(d, datetime):
         return d.replace(tzinfo=None)
+    return _parse_date_str(str(d).strip())
 
-    s = str(d).strip()
+@lru_cache(maxsize=4096)
+def _parse_date_str(s: str) -> Optional[datetime]:
+    # Cached: the same few date strings repeat across every row of a digest
     if not s or s.upper() in ("N/A", "NA", "NONE"):
         return None
 
@@ -97,12 +127,14 @@ def _parse_date(d: Any) -> Optional[datetime]:
         except Exception:
             pass
 
+    fast = _parse_numeric_date(s)
+    if fast is not None:
+        return fast
+
     # Try direct formats
-    for fmt in _DATE_FORMATS:
-        try:
-            return datetime.strptime(s, fmt)
-        except Exception:
-            continue
+    parsed = _strptime_by_shape(s)
+    if parsed is not None:
+        return parsed
 
     # If there is extra content (like "13/12/25 11:20 AM" or "13/12/25 - something")
     # try to extract the first plausible date-ish token substring and parse again.
@@ -138,14 +170,49 @@ def _parse_date(d: Any) -> Optional[datetime]:
         if not c or c in seen:
             continue
         seen.add(c)
-        for fmt in _DATE_FORMATS:
-            try:
-                return datetime.strptime(c, fmt)
-            except Exception:
-                continue
+        parsed = _strptime_by_shape(c)
+        if parsed is not None:
+            return parsed
+
+    return None
 
+def _strptime_by_shape(s: str) -> Optional[datetime]:
+    """First _DATE_FORMATS entry that parses `s`, trying only formats of its shape."""
+    for fmt in _FORMATS_BY_SHAPE.get(_date_shape(s), ()):
+        try:
+            return datetime.strptime(s, fmt)
+        except ValueError:
+            continue
     return None
 
+def _parse_numeric_date(s: str) -> Optional[datetime]:
+    """
+    Y-M-D[ H:M[:S]], Y/M/D, D/M/Y[,] H:M, D/M/YY[,] H:M or D-M-Y[ H:M];
+    None when strptime must decide.
+    """
+    m = _ISO_DATE_RE.fullmatch(s)
+    if m:
+        # Y/M/D has no time format; Y-M-D takes " H:M" or " H:M:S"
+        if m["H"] and (m["sep"] == "/" or "," in m["tsep"]):
+            return None
+    else:
+        m = _DMY_DATE_RE.fullmatch(s)
+        if not m or (m["sep"] == "-" and len(m["y"]) == 2):
+            return None
+        # Day-first times are " H:M" (", H:M" with slashes), never seconds
+        if m["H"] and (m["S"] or (m["sep"] == "-" and "," in m["tsep"])):
+            return None
+
+    y = int(m["y"])
+    if len(m["y"]) == 2:
+        y += 2000 if y < 69 else 1900  # strptime's %y pivot
+    try:
+        if m["H"]:
+            return datetime(y, int(m["m"]), int(m["d"]), int(m["H"]), int(m["M"]), int(m["S"] or 0))
+        return datetime(y, int(m["m"]), int(m["d"]))
+    except ValueError:
+        return None
+
 def _to_float_percent(val: Any) -> Optional[float]:
     """Extract a number from '83.3%' / '83' / 'N/A'. Return float percentage (0-100) or None."""
     if val is None:
@@ -153,7 +220,7 @@ def _to_float_percent(val: Any) -> Optional[float]:
     s = str(val).strip()
     if not s or s.upper() in ("N/A", "NA", "NONE"):
         return None
-    m = re.search(r"[-+]?\d*\.?\d+", s.replace(",", ""))
+    m = _PERCENT_RE.search(s.replace(",", ""))
     if not m:
         return None
     try:
@@ -169,7 +236,7 @@ def _to_float_amount_inr(val: Any) -> float:
     if val is None:
         return 0.0
     s = str(val)
-    m = re.search(r"[-+]?\d[\d,]*\.?\d*", s.replace("₹", ""))
+    m = _AMOUNT_RE.search(s.replace("₹", ""))
     if not m:
         return 0.0
     try:
@@ -183,9 +250,30 @@ def _clean_name(s: Any) -> str:
 # -----------------------
 # Data Fetching from Sheets
 # -----------------------
-def fetch_manager_data(spreadsheet, config: Dict, manager_name: str, last_n_days: int) -> List[Dict]:
+# The only Results columns the digest reads
+DIGEST_FIELDS = ("Manager", "Date", "% Score", "Amount Value", "Owner (Who handled the meeting)")
+
+# Key under which fetch_manager_data stores each record's parsed Date
+PARSED_DATE = "_parsed_date"
+
+def _read_columns(ws, fields) -> Dict[str, List[str]]:
     """
-    Fetch rows from Results tab for the given manager within last_n_days.
+    Fetch just `fields` (by header name) in one batch_get, as
+    {field: column values below the header}. Missing headers are skipped.
+    """
+    from gspread.utils import rowcol_to_a1
+
+    header = ws.row_values(1)
+    cols = {f: header.index(f) + 1 for f in fields if f in header}
+    if not cols:
+        return {}
+    letters = [rowcol_to_a1(1, c)[:-1] for c in cols.values()]
+    ranges = ws.batch_get([f"{col}2:{col}" for col in letters])
+    return {f: [cell[0] if cell else "" for cell in rng] for f, rng in zip(cols, ranges)}
+
+def fetch_results_columns(spreadsheet, config: Dict) -> Dict[str, List[str]]:
+    """
+    Read the digest columns of the Results tab once per run.
     Uses config.google_sheets.results_tab_name (your config: "Analysis Results").
     """
     tab = config.get("google_sheets", {}).get("results_tab_name", "Analysis Results")
@@ -194,39 +282,50 @@ def fetch_manager_data(spreadsheet, config: Dict, manager_name: str, last_n_days
         ws = spreadsheet.worksheet(tab)
     except Exception as e:
         logging.error(f"Could not open worksheet '{tab}': {e}")
-        return []
+        return {}
 
     try:
-        rows = ws.get_all_records()
+        return _read_columns(ws, DIGEST_FIELDS)
     except Exception as e:
         logging.error(f"Could not read records from '{tab}': {e}")
-        return []
+        return {}
+
+def group_rows_by_manager(columns: Dict[str, List[str]]) -> Dict[str, List[int]]:
+    """Row indices per normalized Manager value (column must be "Manager")."""
+    groups: Dict[str, List[int]] = defaultdict(list)
+    for i, mgr in enumerate(columns.get("Manager", [])):
+        groups[_normalize_text(_clean_name(mgr))].append(i)
+    return groups
+
+def fetch_manager_data(columns: Dict[str, List[str]], manager_name: str, last_n_days: int,
+                       now: Optional[datetime] = None,
+                       rows_by_manager: Optional[Dict[str, List[int]]] = None) -> List[Dict]:
+    """
+    Pick the given manager's rows within last_n_days from the columns
+    returned by fetch_results_columns(). Pass group_rows_by_manager(columns)
+    when calling once per manager, so each call visits only its own rows.
+    """
+    if rows_by_manager is None:
+        rows_by_manager = group_rows_by_manager(columns)
+    dates = columns.get("Date", [])
 
-    now = datetime.now()
+    now = now or datetime.now()
     cutoff = now - timedelta(days=last_n_days)
+    latest = now + timedelta(days=1)
 
     target_mgr = _normalize_text(manager_name)
     picked: List[Dict] = []
     skipped_bad_dates = 0
-    matched_manager_count = 0
+
+    # Manager match (normalized)
+    row_ids = rows_by_manager.get(target_mgr, [])
+    matched_manager_count = len(row_ids)
 
     # For debug
-    unique_mgrs = set()
     dates_seen = []
 
-    for r in rows:
-        mgr_raw = _clean_name(r.get("Manager", ""))  # column must be "Manager"
-        mgr_norm = _normalize_text(mgr_raw)
-        if mgr_norm:
-            unique_mgrs.add(mgr_raw.strip())
-
-        # Manager match (normalized)
-        if mgr_norm != target_mgr:
-            continue
-
-        matched_manager_count += 1
-
-        dval = r.get("Date")
+    for i in row_ids:
+        dval = dates[i] if i < len(dates) else ""
         d = _parse_date(dval)
         if not d:
             skipped_bad_dates += 1
@@ -235,8 +334,11 @@ def fetch_manager_data(spreadsheet, config: Dict, manager_name: str, last_n_days
         dates_seen.append(d)
 
         # Keep if within lookback window (tolerate slight future entries)
-        if cutoff <= d <= (now + timedelta(days=1)):
-            picked.append(r)
+        # Only rows that are kept become dicts; the parsed date rides along
+        if cutoff <= d <= latest:
+            rec = {f: (v[i] if i < len(v) else "") for f, v in columns.items()}
+            rec[PARSED_DATE] = d
+            picked.append(rec)
 
     if not picked:
         logging.info(f"Found 0 records for {manager_name}.")
@@ -244,6 +346,9 @@ def fetch_manager_data(spreadsheet, config: Dict, manager_name: str, last_n_days
         logging.info(f"DEBUG: Rows skipped due to bad/NA dates: {skipped_bad_dates}")
 
         # show manager values available (helps detect spelling mismatch)
+        unique_mgrs = {
+            _clean_name(m) for m in columns.get("Manager", []) if _normalize_text(_clean_name(m))
+        }
         if unique_mgrs:
             sample = sorted(unique_mgrs)[:30]
             logging.info(f"DEBUG: Sample manager values in sheet (first 30): {sample}")
@@ -280,52 +385,44 @@ def process_team_data(team_records: List[Dict], last_n_days: int) -> Tuple[Dict,
     w2_end = now - timedelta(days=7)
 
     total_meetings = len(team_records)
-    scores: List[float] = []
-    pipeline_total = 0.0
-
-    prev_week_by_owner: Dict[str, List[float]] = {}
-
-    for r in team_records:
-        s = _to_float_percent(r.get("% Score"))
-        if s is not None:
-            scores.append(s)
-
-        pipeline_total += _to_float_amount_inr(r.get("Amount Value"))
-
-        d = _parse_date(r.get("Date"))
-        if d and (w2_start <= d < w2_end):
-            owner = _safe_owner(r)
-            prev_s = _to_float_percent(r.get("% Score"))
-            if prev_s is not None:
-                prev_week_by_owner.setdefault(owner, []).append(prev_s)
-
-    avg_score = (sum(scores) / len(scores)) if scores else 0.0
-
-    team_performance: List[Dict] = []
-    owners = sorted({_safe_owner(r) for r in team_records})
-    for owner in owners:
-        rep_meetings = [r for r in team_records if _safe_owner(r) == owner]
-
-        rep_scores = []
-        for rr in rep_meetings:
-            ps = _to_float_percent(rr.get("% Score"))
-            if ps is not None:
-                rep_scores.append(ps)
 
-        rep_avg = (sum(rep_scores) / len(rep_scores)) if rep_scores else 0.0
-        rep_pipeline = sum(_to_float_amount_inr(r.get("Amount Value")) for r in rep_meetings)
-
-        prev_list = prev_week_by_owner.get(owner, [])
-        prev_avg = (sum(prev_list) / len(prev_list)) if prev_list else rep_avg
-        score_change = rep_avg - prev_avg
-
-        team_performance.append({
-            "owner": owner,
-            "meetings": len(rep_meetings),
-            "avg_score": rep_avg,
-            "pipeline": rep_pipeline,
-            "score_change": score_change,
-        })
+    # Parse each field once into columns, then aggregate per rep with
+    # bincount over the owner codes (np.unique sorts owners like sorted()).
+    owners = [_safe_owner(r) for r in team_records]
+    parsed = [_to_float_percent(r.get("% Score")) for r in team_records]
+    scores = np.array([np.nan if v is None else v for v in parsed], dtype=float)
+    amounts = np.array([_to_float_amount_inr(r.get("Amount Value")) for r in team_records], dtype=float)
+    dates = [r[PARSED_DATE] if PARSED_DATE in r else _parse_date(r.get("Date")) for r in team_records]
+    in_prev_week = np.array([bool(d) and w2_start <= d < w2_end for d in dates], dtype=bool)
+
+    has_score = ~np.isnan(scores)
+    score_vals = np.where(has_score, scores, 0.0)
+    avg_score = float(score_vals[has_score].mean()) if has_score.any() else 0.0
+    pipeline_total = float(amounts.sum())
+
+    names, codes = np.unique(np.array(owners, dtype=object), return_inverse=True)
+    n = len(names)
+    meetings = np.bincount(codes, minlength=n)
+    score_n = np.bincount(codes, weights=has_score, minlength=n)
+    score_sum = np.bincount(codes, weights=score_vals, minlength=n)
+    pipeline = np.bincount(codes, weights=amounts, minlength=n)
+    prev_mask = has_score & in_prev_week
+    prev_n = np.bincount(codes, weights=prev_mask, minlength=n)
+    prev_sum = np.bincount(codes, weights=np.where(prev_mask, scores, 0.0), minlength=n)
+
+    rep_avg = np.divide(score_sum, score_n, out=np.zeros(n), where=score_n > 0)
+    prev_avg = np.divide(prev_sum, prev_n, out=rep_avg.copy(), where=prev_n > 0)
+
+    team_performance: List[Dict] = [
+        {
+            "owner": str(names[i]),
+            "meetings": int(meetings[i]),
+            "avg_score": float(rep_avg[i]),
+            "pipeline": float(pipeline[i]),
+            "score_change": float(rep_avg[i] - prev_avg[i]),
+        }
+        for i in range(n)
+    ]
 
     coaching_notes: List[Dict] = []
     for rep in team_performance:
@@ -350,41 +447,136 @@ def process_team_data(team_records: List[Dict], last_n_days: int) -> Tuple[Dict,
 # -----------------------
 # AI Summary (Gemini; optional)
 # -----------------------
+# Fixed instructions go out once as system_instruction; each prompt carries
+# only the manager's numbers.
+SUMMARY_INSTRUCTIONS = """You are a senior sales analyst writing a 2–3 sentence executive summary for a sales manager.
+Base your summary ONLY on the data you are given. Mention:
+1) one key trend,
+2) one bright spot,
+3) one improvement area.
+
+Return ONLY the summary text, nothing else."""
+
+@lru_cache(maxsize=1)
+def _genai():
+    """google.generativeai on first use (grpc/protobuf are slow to load); None if not installed."""
+    try:
+        import google.generativeai as genai
+    except Exception:
+        return None
+    return genai
+
+_summary_models: Dict[str, Any] = {}
+_summary_models_lock = threading.Lock()
+
+def _summary_model(model_name: str):
+    """One configured model per name, reused for every manager's summary."""
+    genai = _genai()
+    with _summary_models_lock:
+        model = _summary_models.get(model_name)
+        if model is None:
+            if not _summary_models:
+                genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+            model = _summary_models[model_name] = genai.GenerativeModel(
+                model_name, system_instruction=SUMMARY_INSTRUCTIONS
+            )
+        return model
+
+# Summaries keyed by sha256(model, instructions, prompt): identical inputs
+# (same manager, same numbers) reuse the stored text instead of a new call.
+_summary_memo: Dict[str, str] = {}
+_summary_memo_lock = threading.Lock()
+
+def _summary_cache_path(key: str, config: Dict) -> Optional[str]:
+    cache_cfg = config.get("cache", {}) or {}
+    if not cache_cfg.get("enabled", True):
+        return None
+    return os.path.join(cache_cfg.get("dir", "cache"), "summaries", f"{key}.txt")
+
+def _load_summary(key: str, config: Dict) -> Optional[str]:
+    with _summary_memo_lock:
+        if key in _summary_memo:
+            return _summary_memo[key]
+    path = _summary_cache_path(key, config)
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable summary cache entry {path}: {e}")
+        return None
+    with _summary_memo_lock:
+        _summary_memo[key] = text
+    return text
+
+def _store_summary(key: str, text: str, config: Dict):
+    with _summary_memo_lock:
+        _summary_memo[key] = text
+    path = _summary_cache_path(key, config)
+    if not path:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logging.warning(f"Could not write summary cache entry {path}: {e}")
+
 def _generate_ai_summary(manager_name: str, kpis: Dict, team_data: List[Dict], config: Dict) -> str:
     """Use Gemini to write a short executive summary (2–3 sentences)."""
-    if genai is None or not os.environ.get("GEMINI_API_KEY"):
+    wd = config.get("weekly_digest") or {}
+
+    # Too little activity for a trend; not worth a model round trip
+    min_meetings = int(wd.get("summary_min_meetings", 2))
+    if kpis["total_meetings"] < min_meetings:
+        return (f"Only {kpis['total_meetings']} meeting(s) this week for {manager_name}; "
+                "no material trend to report.")
+
+    if not os.environ.get("GEMINI_API_KEY") or _genai() is None:
         return "Summary not available this week."
 
     model_name = (config.get("google_llm") or {}).get("model", "gemini-2.5-flash")
 
-    prompt = f"""
-You are a senior sales analyst writing a 2–3 sentence executive summary for {manager_name}.
-Base your summary ONLY on the data below. Mention:
-1) one key trend,
-2) one bright spot,
-3) one improvement area.
+    # Pipe table, one line per rep. team_data is sorted by score, so a large
+    # team keeps its top and bottom reps; the KPIs above still cover everyone.
+    max_reps = max(2, int(wd.get("summary_max_reps", 20)))
+    shown = team_data
+    if len(team_data) > max_reps:
+        half = max_reps // 2
+        shown = team_data[:half] + team_data[-(max_reps - half):]
+    lines = ["owner|avg_score|meetings|pipeline|wow_change"]
+    for i, t in enumerate(shown):
+        if shown is not team_data and i == max_reps // 2:
+            lines.append(f"... {len(team_data) - max_reps} mid-table reps omitted ...")
+        lines.append(f"{t['owner']}|{t['avg_score']:.1f}|{t['meetings']}|{t['pipeline']:.0f}|{t['score_change']:+.1f}")
+    team_table = "\n".join(lines)
+
+    prompt = f"""Manager: {manager_name}
 
 KPIs:
 - Total Meetings: {kpis['total_meetings']}
 - Team Avg Score: {kpis['avg_score']:.1f}%
 - Pipeline Value: {email_formatter.format_currency(kpis['total_pipeline'])}
 
-Team Performance (owner, avg_score, meetings, pipeline, WoW change):
-{json.dumps([
-    {"owner": t["owner"], "avg_score": round(t["avg_score"], 1), "meetings": t["meetings"],
-     "pipeline": t["pipeline"], "score_change": round(t["score_change"], 1)}
-    for t in team_data
-], indent=2)}
-
-Return ONLY the summary text, nothing else.
+Team Performance:
+{team_table}
 """
 
+    key = hashlib.sha256("\0".join((model_name, SUMMARY_INSTRUCTIONS, prompt)).encode("utf-8")).hexdigest()
+    cached = _load_summary(key, config)
+    if cached:
+        return cached
+
     try:
-        genai.configure(api_key=os.environ["GEMINI_API_KEY"])
-        model = genai.GenerativeModel(model_name)
-        resp = model.generate_content(prompt)
-        text = getattr(resp, "text", "") or ""
-        return text.strip() if text.strip() else "Summary not available this week."
+        resp = _summary_model(model_name).generate_content(prompt)
+        text = (getattr(resp, "text", "") or "").strip()
+        if not text:
+            return "Summary not available this week."
+        _store_summary(key, text, config)
+        return text
     except Exception as e:
         logging.error(f"Gemini summary failed: {e}")
         return "Summary not available this week."
@@ -392,8 +584,37 @@ Return ONLY the summary text, nothing else.
 # -----------------------
 # Email sending (robust)
 # -----------------------
+# One authenticated connection shared by every digest in the run; sends are
+# serialized on it (smtplib isn't thread-safe) while summaries stay parallel.
+_smtp = None
+_smtp_lock = threading.Lock()
+
+def _smtp_connect(host: str, port: int, use_tls: bool, sender: str, password: str):
+    import smtplib
+
+    if use_tls:
+        server = smtplib.SMTP(host, port)
+        server.ehlo()
+        server.starttls()
+    else:
+        server = smtplib.SMTP_SSL(host, port)
+    server.login(sender, password)
+    return server
+
+def close_smtp():
+    """Quit the shared SMTP connection, if one was opened."""
+    global _smtp
+    with _smtp_lock:
+        if _smtp is not None:
+            try:
+                _smtp.quit()
+            except Exception:
+                pass
+            _smtp = None
+
 def send_email(subject: str, html_content: str, recipient: str):
     """Sends digest email via SMTP (SSL 465 default or STARTTLS 587 with MAIL_USE_TLS=true)."""
+    global _smtp
     import smtplib
     from email.mime.multipart import MIMEMultipart
     from email.mime.text import MIMEText
@@ -409,8 +630,8 @@ def send_email(subject: str, html_content: str, recipient: str):
 
     if not sender or not password:
         logging.warning("MAIL_USERNAME or MAIL_PASSWORD missing. Printing preview instead of sending.")
-        print("\n--- EMAIL CONTENT PREVIEW ---\n")
-        print(f"TO: {recipient}\nSUBJECT: {subject}\n{html_content[:1200]}...\n")
+        # One write per preview; concurrent digests don't interleave lines
+        print(f"\n--- EMAIL CONTENT PREVIEW ---\n\nTO: {recipient}\nSUBJECT: {subject}\n{html_content[:1200]}...\n")
         return
 
     msg = MIMEMultipart("alternative")
@@ -419,38 +640,55 @@ def send_email(subject: str, html_content: str, recipient: str):
     msg["To"] = recipient
     msg.attach(MIMEText(html_content, "html"))
 
-    try:
-        if use_tls:
-            server = smtplib.SMTP(host, port)
-            server.ehlo()
-            server.starttls()
-            server.login(sender, password)
-        else:
-            server = smtplib.SMTP_SSL(host, port)
-            server.login(sender, password)
-
-        server.sendmail(sender, [recipient], msg.as_string())
-        server.quit()
-        logging.info(f"SUCCESS: Email sent to {recipient}")
-
-    except smtplib.SMTPAuthenticationError as e:
-        code = getattr(e, "smtp_code", None)
-        emsg = getattr(e, "smtp_error", b"").decode(errors="ignore")
-        logging.error(
-            f"SMTP auth failed ({code}): {emsg}. "
-            "Tip: For Gmail, enable 2-Step Verification and use an App Password."
-        )
-    except Exception as e:
-        logging.error(f"ERROR sending email: {e}")
+    with _smtp_lock:
+        try:
+            for attempt in range(2):
+                if _smtp is None:
+                    _smtp = _smtp_connect(host, port, use_tls, sender, password)
+                try:
+                    _smtp.sendmail(sender, [recipient], msg.as_string())
+                    break
+                except smtplib.SMTPServerDisconnected:
+                    # Server dropped the idle connection; log in again once
+                    _smtp = None
+                    if attempt:
+                        raise
+            logging.info(f"SUCCESS: Email sent to {recipient}")
+
+        except smtplib.SMTPAuthenticationError as e:
+            code = getattr(e, "smtp_code", None)
+            emsg = getattr(e, "smtp_error", b"").decode(errors="ignore")
+            logging.error(
+                f"SMTP auth failed ({code}): {emsg}. "
+                "Tip: For Gmail, enable 2-Step Verification and use an App Password."
+            )
+        except Exception as e:
+            _smtp = None  # don't reuse a connection in an unknown state
+            logging.error(f"ERROR sending email: {e}")
 
 # -----------------------
 # Main
 # -----------------------
+def _deliver_digest(manager: str, email: str, kpis: Dict, team_data: List[Dict],
+                    coaching_notes: List[Dict], config: Dict):
+    """Summarize, render and send one manager's digest."""
+    ai_summary = _generate_ai_summary(manager, kpis, team_data, config)
+
+    html_email = email_formatter.create_manager_digest_email(
+        manager_name=manager,
+        kpis=kpis,
+        team_data=team_data,
+        coaching_notes=coaching_notes,
+        ai_summary=ai_summary,
+    )
+
+    subject = f"Weekly Meeting Digest | {manager} | {time.strftime('%b %d, %Y')}"
+    send_email(subject, html_email, email)
+
 def main():
     logging.info("--- Starting Weekly Digest Generator ---")
 
-    with open("config.yaml", "r", encoding="utf-8") as f:
-        config = yaml.safe_load(f)
+    config = config_index.read_config("config.yaml")
 
     if not config.get("weekly_digest", {}).get("enabled", False):
         logging.info("Weekly digest disabled in config.yaml. Exiting.")
@@ -465,27 +703,41 @@ def main():
     wd = config.get("weekly_digest", {})
     last_n_days = int(wd.get("last_n_days", wd.get("lookback_days", 7)))
 
-    for manager, email in manager_emails.items():
-        logging.info(f"--- Generating digest for {manager} ---")
-
-        records = fetch_manager_data(spreadsheet, config, manager, last_n_days)
-        if not records:
-            logging.info(f"No data for {manager} in the last {last_n_days} day(s).")
-            continue
-
-        kpis, team_data, coaching_notes = process_team_data(records, last_n_days)
-        ai_summary = _generate_ai_summary(manager, kpis, team_data, config)
-
-        html_email = email_formatter.create_manager_digest_email(
-            manager_name=manager,
-            kpis=kpis,
-            team_data=team_data,
-            coaching_notes=coaching_notes,
-            ai_summary=ai_summary,
-        )
+    # One sheet read for all managers; each digest filters it in memory
+    columns = fetch_results_columns(spreadsheet, config)
+    rows_by_manager = group_rows_by_manager(columns)
+    now = datetime.now()
 
-        subject = f"Weekly Meeting Digest | {manager} | {time.strftime('%b %d, %Y')}"
-        send_email(subject, html_email, email)
+    # The Gemini summary dominates each digest and is independent per
+    # manager, so digests run on a small pool; the sends share one SMTP login.
+    workers = max(1, int(wd.get("send_workers", 4)))
+    failed = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            for manager, email in manager_emails.items():
+                logging.info(f"--- Generating digest for {manager} ---")
+
+                records = fetch_manager_data(columns, manager, last_n_days, now, rows_by_manager)
+                if not records:
+                    logging.info(f"No data for {manager} in the last {last_n_days} day(s).")
+                    continue
+
+                kpis, team_data, coaching_notes = process_team_data(records, last_n_days)
+                futures[pool.submit(_deliver_digest, manager, email, kpis, team_data, coaching_notes, config)] = manager
+
+            # One manager's failure must not hide the others'
+            for fut, manager in futures.items():
+                try:
+                    fut.result()
+                except Exception as e:
+                    logging.error(f"ERROR delivering digest for {manager}: {e}", exc_info=True)
+                    failed.append(manager)
+    finally:
+        close_smtp()
+
+    if failed:
+        raise RuntimeError(f"Digest delivery failed for: {', '.join(failed)}")
 
     logging.info("--- Weekly Digest Generator Finished ---")
 
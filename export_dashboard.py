@@ -1,12 +1,12 @@
 # export_dashboard.py
 import os
 import json
-import yaml
 import logging
 import shutil
 
 # This script relies on your custom 'sheets.py' module to handle Google Sheets communication.
 import sheets
+import config_index
 
 # Configure logging for clear output during GitHub Actions runs.
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -16,8 +16,7 @@ def main():
     Main function to fetch data from Google Sheets and export it for the web dashboard.
     """
     # Load the central configuration file.
-    with open("config.yaml", "r", encoding="utf-8") as f:
-        config = yaml.safe_load(f)
+    config = config_index.read_config("config.yaml")
 
     # Authenticate with Google Sheets using the service account key.
     gs = sheets.authenticate_google_sheets(config)
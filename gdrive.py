@@ -198,7 +198,7 @@ def get_files_to_process(
         files = service.files().list(
             q=query,
             orderBy="createdTime",
-            fields="files(id, name, mimeType, createdTime, size)",
+            fields="files(id, name, mimeType, createdTime, size, md5Checksum)",
         ).execute().get("files", [])
 
         new_files = [
@@ -9,12 +9,13 @@ os.environ.setdefault("GRPC_CPP_VERBOSITY", "NONE")
 os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "3")
 os.environ.setdefault("ABSL_LOGGING_MIN_LOG_LEVEL", "3")
 
-import yaml
 import logging
 import json
 import sys
 import time
+import threading
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
@@ -23,6 +24,7 @@ import gspread
 import gdrive
 import analysis
 import sheets
+import config_index
 
 # -------------------------------------------------------------------
 # LOGGING
@@ -61,11 +63,11 @@ def authenticate_google(config):
         sheets.ensure_tabs_exist(sheet, config)
         logging.info("SUCCESS: Authenticated Google Sheets")
 
-        return drive_service, sheet
+        return drive_service, sheet, creds
 
     except Exception as e:
         logging.error(f"CRITICAL: Google authentication failed: {e}", exc_info=True)
-        return None, None
+        return None, None, None
 
 # -------------------------------------------------------------------
 # DASHBOARD EXPORT
@@ -103,7 +105,7 @@ def export_data_for_dashboard(gsheets_sheet, config):
 # -------------------------------------------------------------------
 # QUARANTINE RETRY
 # -------------------------------------------------------------------
-def retry_quarantined_files(drive_service, gsheets_sheet, config):
+def retry_quarantined_files(drive_service, writer, config):
     try:
         hours = int(config.get("quarantine", {}).get("auto_retry_after_hours", 24))
         if hours <= 0:
@@ -127,18 +129,120 @@ def retry_quarantined_files(drive_service, gsheets_sheet, config):
             modified_dt = dt.datetime.fromisoformat(modified.replace("Z", "+00:00"))
             if now_epoch - modified_dt.timestamp() > cooldown:
                 gdrive.move_file(drive_service, f["id"], quarantine_id, parent_id)
-                sheets.update_ledger(
-                    gsheets_sheet,
-                    f["id"],
-                    "Pending",
-                    f"Auto-retry after {hours}h",
-                    config,
-                    f["name"]
-                )
+                writer.enqueue_ledger(f["id"], "Pending", f"Auto-retry after {hours}h", f["name"])
 
     except Exception as e:
         logging.error(f"Error during quarantine retry: {e}", exc_info=True)
 
+# -------------------------------------------------------------------
+# PREPARE WORKERS
+# -------------------------------------------------------------------
+_worker_local = threading.local()
+
+
+def _worker_drive_service(creds):
+    """googleapiclient services are not thread-safe; one per worker thread."""
+    service = getattr(_worker_local, "drive_service", None)
+    if service is None:
+        service = build("drive", "v3", credentials=creds, cache_discovery=False)
+        _worker_local.drive_service = service
+    return service
+
+
+def _prepare_in_worker(creds, file_meta, member_name, config):
+    return analysis.prepare_file(_worker_drive_service(creds), file_meta, member_name, config)
+
+
+def collect_prepared(drive_service, writer, inflight, pending, config):
+    """
+    Wait for at least one in-flight prepare to finish and move finished jobs
+    into `pending`; failures are quarantined right away.
+    """
+    done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+
+    for fut in done:
+        file_meta, folder_id = inflight.pop(fut)
+        file_id = file_meta["id"]
+        file_name = file_meta.get("name", file_id)
+
+        try:
+            pending.append((fut.result(), folder_id))
+        except Exception as e:
+            logging.error(f"FAILED: {file_name} → {e}", exc_info=True)
+            quarantine_failed_file(drive_service, writer, file_id, folder_id, file_name, e, config)
+
+# -------------------------------------------------------------------
+# PER-FILE OUTCOMES
+# -------------------------------------------------------------------
+def quarantine_failed_file(drive_service, writer, file_id, folder_id, file_name, exc, config):
+    error_summary = f"{type(exc).__name__}: {str(exc)[:150]}"
+    logging.error(f"File failed: {file_name} → {error_summary}")
+
+    try:
+        gdrive.quarantine_file(
+            drive_service,
+            file_id,
+            folder_id,
+            error_summary,
+            config
+        )
+        writer.enqueue_ledger(file_id, "Quarantined", error_summary, file_name)
+    except Exception:
+        pass
+
+
+def flush_batch(drive_service, writer, pending, processed_ids, config) -> int:
+    """
+    Run the analysis stage over prepared jobs, write their rows in one
+    Sheets call, then move successes to the processed folder and
+    quarantine failures. Returns the success count.
+    """
+    if not pending:
+        return 0
+
+    outcome = analysis.run_batch(writer, [job for job, _ in pending], config)
+
+    # Rows must be in the sheet before files leave the inbox; flush() only
+    # raises when the results append itself failed (ledger errors are retried)
+    ok_ids = [fid for fid, err in outcome.items() if err is None]
+    try:
+        writer.flush()
+    except Exception as e:
+        logging.error(f"ERROR writing batch results: {e}", exc_info=True)
+        writer.discard(ok_ids)
+        outcome.update({fid: e for fid in ok_ids})
+
+    done = 0
+
+    for job, folder_id in pending:
+        file_id = job["file_id"]
+        file_name = job["file_name"]
+        error = outcome.get(file_id)
+
+        if error is not None:
+            quarantine_failed_file(drive_service, writer, file_id, folder_id, file_name, error, config)
+            continue
+
+        try:
+            gdrive.move_file(
+                drive_service,
+                file_id,
+                folder_id,
+                config["google_drive"]["processed_folder_id"]
+            )
+
+            writer.enqueue_ledger(file_id, "Processed", "Completed successfully", file_name)
+            analysis.drop_cached(job.get("md5"), config)
+
+            processed_ids.add(file_id)
+            done += 1
+
+        except Exception as e:
+            quarantine_failed_file(drive_service, writer, file_id, folder_id, file_name, e, config)
+
+    pending.clear()
+    return done
+
 # -------------------------------------------------------------------
 # MAIN
 # -------------------------------------------------------------------
@@ -150,10 +254,9 @@ def main():
         logging.error("CRITICAL: config.yaml not found")
         sys.exit(1)
 
-    with open(config_path, "r", encoding="utf-8") as f:
-        config = yaml.safe_load(f)
+    config = config_index.load_config(config_path)
 
-    drive_service, gsheets_sheet = authenticate_google(config)
+    drive_service, gsheets_sheet, creds = authenticate_google(config)
     if not drive_service or not gsheets_sheet:
         sys.exit(1)
 
@@ -163,81 +266,63 @@ def main():
         processed_ids = set()
         logging.warning("Could not read processed IDs. Will process all files.")
 
-    retry_quarantined_files(drive_service, gsheets_sheet, config)
+    sheets_cfg = config["google_sheets"]
+    writer = sheets.SheetsWriter(
+        gsheets_sheet,
+        config,
+        flush_interval=float(sheets_cfg.get("flush_interval_sec", 5)),
+        max_buffer=int(sheets_cfg.get("flush_max_rows", 50)),
+    )
+
+    retry_quarantined_files(drive_service, writer, config)
 
     team_folders = gdrive.discover_team_folders(
         drive_service,
         config["google_drive"]["parent_folder_id"]
     )
 
-    max_files = int(config.get("processing", {}).get("max_files_per_run", 999999))
-    sleep_sec = float(config.get("processing", {}).get("sleep_between_files_sec", 1.5))
+    processing_cfg = config.get("processing", {})
+    max_files = int(processing_cfg.get("max_files_per_run", 999999))
+    sleep_sec = float(processing_cfg.get("sleep_between_files_sec", 1.5))
+    prepare_workers = max(1, int(processing_cfg.get("prepare_workers", 2)))
+    max_inflight = max(prepare_workers, int(processing_cfg.get("max_inflight", prepare_workers * 2)))
+    batch_size = max(1, int(config.get("google_llm", {}).get("batch_size", analysis.BATCH_SIZE)))
 
     processed_this_run = 0
+    pending = []   # (prepared job, source folder id)
+    inflight = {}  # prepare future → (file_meta, source folder id)
+
+    # Download + transcription run on the worker pool while finished jobs
+    # are analyzed and written from this thread: whatever is ready gets
+    # analyzed as soon as every prepare worker is busy with the next files
+    # (batch_size only caps a batch), so the two stages overlap.
+    with ThreadPoolExecutor(max_workers=prepare_workers) as pool:
+        for member_name, folder_id in team_folders.items():
+            files = gdrive.get_files_to_process(drive_service, folder_id, processed_ids)
+
+            for file_meta in files:
+                if processed_this_run + len(pending) + len(inflight) >= max_files:
+                    break
+
+                fut = pool.submit(_prepare_in_worker, creds, file_meta, member_name, config)
+                inflight[fut] = (file_meta, folder_id)
+
+                if len(inflight) >= max_inflight:
+                    collect_prepared(drive_service, writer, inflight, pending, config)
+
+                if len(pending) >= batch_size or (pending and len(inflight) >= prepare_workers):
+                    processed_this_run += flush_batch(drive_service, writer, pending, processed_ids, config)
+
+                if sleep_sec > 0:
+                    time.sleep(sleep_sec)
+
+        while inflight:
+            collect_prepared(drive_service, writer, inflight, pending, config)
+            processed_this_run += flush_batch(drive_service, writer, pending, processed_ids, config)
 
-    for member_name, folder_id in team_folders.items():
-        files = gdrive.get_files_to_process(drive_service, folder_id, processed_ids)
-
-        for file_meta in files:
-            if processed_this_run >= max_files:
-                break
-
-            file_id = file_meta["id"]
-            file_name = file_meta.get("name", file_id)
-
-            try:
-                analysis.process_single_file(
-                    drive_service,
-                    gsheets_sheet,
-                    file_meta,
-                    member_name,
-                    config
-                )
-
-                gdrive.move_file(
-                    drive_service,
-                    file_id,
-                    folder_id,
-                    config["google_drive"]["processed_folder_id"]
-                )
-
-                sheets.update_ledger(
-                    gsheets_sheet,
-                    file_id,
-                    "Processed",
-                    "Completed successfully",
-                    config,
-                    file_name
-                )
-
-                processed_ids.add(file_id)
-                processed_this_run += 1
-
-            except Exception as e:
-                error_summary = f"{type(e).__name__}: {str(e)[:150]}"
-                logging.error(f"File failed: {file_name} → {error_summary}")
-
-                try:
-                    gdrive.quarantine_file(
-                        drive_service,
-                        file_id,
-                        folder_id,
-                        error_summary,
-                        config
-                    )
-                    sheets.update_ledger(
-                        gsheets_sheet,
-                        file_id,
-                        "Quarantined",
-                        error_summary,
-                        config,
-                        file_name
-                    )
-                except Exception:
-                    pass
-
-            if sleep_sec > 0:
-                time.sleep(sleep_sec)
+    processed_this_run += flush_batch(drive_service, writer, pending, processed_ids, config)
+    writer.close()
+    analysis.prune_cache(config)
 
     export_data_for_dashboard(gsheets_sheet, config)
 
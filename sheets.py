@@ -4,7 +4,9 @@ from typing import Dict, List
 from google.oauth2 import service_account
 import os
 import json
+import atexit
 import datetime
+import threading
 
 # ---------- Default Headers (47) ----------
 DEFAULT_HEADERS = [
@@ -79,71 +81,163 @@ def ensure_tabs_exist(sheet, config: Dict):
         lw = sheet.add_worksheet(title=ledger_tab, rows="1000", cols="5")
     _ensure_header(lw, LEDGER_HEADERS)
 
-def write_analysis_result(sheet, analysis_data: Dict, config: Dict):
+def _result_row(analysis_data: Dict) -> List:
+    return [analysis_data.get(h, "") if analysis_data.get(h, "") is not None else "" for h in DEFAULT_HEADERS]
+
+# ---------- Buffered writer ----------
+class SheetsWriter:
     """
-    Append a normalized analysis row into the Results sheet.
-    Unknown/missing fields are written as "" (empty) to match schema/dashboards.
+    Buffers result rows and ledger updates and writes them in bulk: one
+    append_rows for results, one col_values read + one batch_update (plus
+    one append_rows for new files) for the ledger. Repeated ledger updates
+    for the same file collapse to the last one.
+
+    A daemon thread flushes every `flush_interval` seconds or once
+    `max_buffer` entries are queued; close() (also run at exit) drains.
+    Call flush() directly when a write must land before moving on.
     """
-    try:
-        ws = sheet.worksheet(config["google_sheets"]["results_tab_name"])
-        row = [analysis_data.get(h, "") if analysis_data.get(h, "") is not None else "" for h in DEFAULT_HEADERS]
-        ws.append_row(row, value_input_option="RAW")
-        logging.info(f"SUCCESS: Wrote analysis result for '{analysis_data.get('Society Name','')}'")
-    except Exception as e:
-        logging.error(f"ERROR writing analysis result: {e}")
-        raise
 
-# --- Compatibility shims so other modules can call flexible names ---
-def append_result(sheet, analysis_data: Dict, config: Dict):
-    return write_analysis_result(sheet, analysis_data, config)
+    def __init__(self, sheet, config: Dict, flush_interval: float = 5.0, max_buffer: int = 50):
+        self.sheet = sheet
+        self.config = config
+        self.flush_interval = flush_interval
+        self.max_buffer = max(1, int(max_buffer))
+
+        self._rows: Dict[str, List] = {}      # file_id → results row
+        self._ledger: Dict[str, List] = {}    # file_id → [file_id, name, status, error, ts]
+        self._lock = threading.Lock()         # guards the buffers
+        self._flush_lock = threading.Lock()   # one writer at a time (gspread is not thread-safe)
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = None
+
+        if flush_interval and flush_interval > 0:
+            self._thread = threading.Thread(target=self._run, name="sheets-writer", daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- enqueue ---
+    def enqueue(self, analysis_data: Dict, file_id: str):
+        with self._lock:
+            self._rows[str(file_id)] = _result_row(analysis_data)
+            full = len(self._rows) + len(self._ledger) >= self.max_buffer
+        if full:
+            self._wake.set()
+
+    def enqueue_ledger(self, file_id: str, status: str, error_msg: str, file_name: str):
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            self._ledger[str(file_id)] = [file_id, file_name, status, (error_msg or "")[:500], timestamp]
+            full = len(self._rows) + len(self._ledger) >= self.max_buffer
+        if full:
+            self._wake.set()
+
+    def discard(self, file_ids):
+        """Drop buffered result rows and ledger entries (e.g. the batch is being quarantined)."""
+        with self._lock:
+            for fid in file_ids:
+                self._rows.pop(str(fid), None)
+                self._ledger.pop(str(fid), None)
+
+    # --- flush ---
+    def flush(self):
+        """
+        Write everything buffered. Only a failed results append raises (its
+        rows and the ledger entries are re-queued): once rows are in the
+        sheet their files count as written. A failed ledger write is logged
+        and its entries re-queued for the next flush.
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, {}
+                ledger, self._ledger = self._ledger, {}
+
+            if rows:
+                try:
+                    ws = self.sheet.worksheet(self.config["google_sheets"]["results_tab_name"])
+                    ws.append_rows(list(rows.values()), value_input_option="RAW")
+                except Exception:
+                    self._requeue(rows, ledger)
+                    raise
+                logging.info(f"SUCCESS: Wrote {len(rows)} analysis result(s)")
+
+            if ledger:
+                try:
+                    self._write_ledger(ledger)
+                except Exception as e:
+                    logging.error(f"ERROR updating ledger for {len(ledger)} file(s) (will retry): {e}")
+                    self._requeue({}, ledger)
+
+    def _requeue(self, rows: Dict[str, List], ledger: Dict[str, List]):
+        with self._lock:
+            # newer entries queued meanwhile take precedence
+            self._rows = {**rows, **self._rows}
+            self._ledger = {**ledger, **self._ledger}
+
+    def _write_ledger(self, ledger: Dict[str, List]):
+        ws = self.sheet.worksheet(self.config["google_sheets"]["ledger_tab_name"])
+        row_of = {str(fid): i for i, fid in enumerate(ws.col_values(1), start=1) if i > 1}
+
+        updates, new_rows = [], []
+        for fid, entry in ledger.items():
+            row_index = row_of.get(fid)
+            if row_index:
+                updates.append({"range": f"C{row_index}:E{row_index}", "values": [entry[2:]]})
+            else:
+                new_rows.append(entry)
+
+        if updates:
+            ws.batch_update(updates, value_input_option="RAW")
+        if new_rows:
+            ws.append_rows(new_rows, value_input_option="RAW")
+        logging.info(f"SUCCESS: Ledger updated for {len(ledger)} file(s)")
+
+    # --- background ---
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._closed:
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"ERROR flushing Sheets buffer (will retry): {e}")
 
-def append_json(sheet, analysis_data: Dict, config: Dict):
-    # Accepts a dict (already parsed). If called with a JSON string, parse it.
-    if isinstance(analysis_data, str):
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
         try:
-            analysis_data = json.loads(analysis_data)
-        except Exception:
-            logging.error("append_json received a non-JSON string; skipping.")
+            self.flush()
+        except Exception as e:
+            with self._lock:
+                lost = sorted(set(self._rows) | set(self._ledger))
+            logging.error(f"ERROR final Sheets flush failed; unwritten file IDs: {lost}: {e}")
             return
-    return write_analysis_result(sheet, analysis_data, config)
-
-def append_raw(sheet, raw_json_str: str, config: Dict):
-    try:
-        data = json.loads(raw_json_str)
-    except Exception:
-        logging.error("append_raw received invalid JSON; skipping.")
-        return
-    return write_analysis_result(sheet, data, config)
-# -------------------------------------------------------------------
-
-def update_ledger(sheet, file_id: str, status: str, error_msg: str, config: Dict, file_name: str):
-    """Update the ledger with processing status for each file."""
-    try:
-        ws = sheet.worksheet(config["google_sheets"]["ledger_tab_name"])
-        records = ws.get_all_records()
-        row_index = None
-        for i, r in enumerate(records, start=2):  # row 1 = headers
-            if str(r.get("File ID")) == str(file_id):
-                row_index = i
-                break
-
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        if row_index:
-            ws.update_cell(row_index, 3, status)                      # Status
-            ws.update_cell(row_index, 4, (error_msg or "")[:500])     # Error
-            ws.update_cell(row_index, 5, timestamp)                   # Timestamp
-        else:
-            ws.append_row([file_id, file_name, status, (error_msg or "")[:500], timestamp],
-                          value_input_option="RAW")
-        logging.info(f"SUCCESS: Ledger updated → {file_name} ({status})")
-    except Exception as e:
-        logging.error(f"ERROR updating ledger for file {file_name}: {e}")
+        with self._lock:
+            lost = sorted(self._ledger)
+        if lost:
+            logging.error(f"ERROR final ledger update failed; file IDs not recorded: {lost}")
 
 def get_processed_file_ids(sheet, config) -> List[str]:
     try:
         ws = sheet.worksheet(config["google_sheets"]["ledger_tab_name"])
-        records = ws.get_all_records()
-        return [str(r.get("File ID")) for r in records if str(r.get("Status")).lower() == "processed"]
+        # Only File ID (A) and Status (C); skips the long Error column
+        ids, statuses = ws.batch_get(["A2:A", "C2:C"])
+        return [
+            str(fid[0]) for fid, st in zip(ids, statuses)
+            if fid and st and str(st[0]).lower() == "processed"
+        ]
     except Exception as e:
         logging.warning(f"Ledger read failed; defaulting to empty processed list: {e}")
         return []